@@ -0,0 +1,117 @@
+#Developed by ODAT project
+#please see https://odat.info
+#please see https://github.com/ODAT-Project
+"""
+deterministic generator of synthetic HA raw dx extracts for benchmarking.
+the same rows and seed always give the same file:
+  - codes follow a zipf-like frequency over a pool of listed ICD-9 codes,
+    codes inside ranges such as '430-438', and non-matching noise codes
+  - cells hold one to five codes joined by mixed separators, some are empty
+  - extra columns make the rows about as wide as a real export
+"""
+import argparse
+import importlib.util
+import os
+import sys
+
+import numpy as np
+
+BUILDER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "icd9-dx-builder.py")
+
+#separators seen between codes in real extracts
+SEPARATORS = [",", ", ", ";", "; ", "|", " "]
+
+#rows written per block
+BLOCK_ROWS = 100_000
+
+def load_builder():
+    """import icd9-dx-builder.py as a module, once per process."""
+    #a second copy would break pickling of its functions for worker processes
+    if "icd9_dx_builder" in sys.modules:
+        return sys.modules["icd9_dx_builder"]
+    #the script imports icd9_dx from its own directory
+    repo = os.path.dirname(os.path.abspath(BUILDER_PATH))
+    if repo not in sys.path:
+        sys.path.insert(0, repo)
+    spec = importlib.util.spec_from_file_location("icd9_dx_builder", BUILDER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def code_pool(builder, rng: np.random.Generator, n_noise: int = 2000) -> list:
+    """return listed, range-covered and noise codes, in zipf rank order."""
+    listed, ranged = [], []
+    for code_list in builder.ALL_CATEGORIES.values():
+        for c in code_list:
+            if "-" not in c:
+                listed.append(c)
+                continue
+            #codes that only a range matches
+            start_val, end_val = (float(v) for v in c.split("-")[:2])
+            for _ in range(20):
+                decimals = int(rng.integers(0, 3))
+                ranged.append(f"{rng.uniform(start_val, end_val):.{decimals}f}")
+    listed = list(dict.fromkeys(listed))
+
+    #noise codes that match no category
+    noise = set()
+    while len(noise) < n_noise:
+        kind = rng.integers(0, 3)
+        if kind == 0:
+            code = f"V{rng.integers(1, 92):02d}.{rng.integers(0, 10)}"
+        elif kind == 1:
+            code = f"E{rng.integers(800, 1000)}.{rng.integers(0, 10)}"
+        else:
+            code = f"{rng.integers(1, 1000):03d}.{rng.integers(0, 100):02d}"
+        if builder.CATEGORY_INDEX.lookup(code) == 0:
+            noise.add(code)
+
+    pool = np.array(listed + ranged + sorted(noise), dtype=object)
+    rng.shuffle(pool)
+    return list(pool)
+
+def generate(path: str, n_rows: int, seed: int = 0, builder=None):
+    """write n_rows synthetic rows to path."""
+    if builder is None:
+        builder = load_builder()
+    rng = np.random.default_rng(seed)
+    pool = code_pool(builder, rng)
+    weights = 1.0 / np.arange(1, len(pool) + 1) ** 1.1
+    weights /= weights.sum()
+    n_patients = max(n_rows // 8, 1)
+    first_day = np.datetime64("2005-01-01")
+    n_days = int((np.datetime64("2020-12-31") - first_day).astype(np.int64))
+    institutions = np.array(["QEH", "PWH", "QMH", "TMH", "UCH", "KWH"], dtype=object)
+
+    with open(path, "w", newline="") as out:
+        out.write("Reference Key,Sex,Admission Age (Year),Institution (IPAS),"
+                  "All Diagnosis Code (ICD9),Reference Date\n")
+        for block_start in range(0, n_rows, BLOCK_ROWS):
+            n = min(BLOCK_ROWS, n_rows - block_start)
+            n_codes = rng.choice([0, 1, 2, 3, 4, 5], size=n, p=[0.02, 0.54, 0.24, 0.12, 0.05, 0.03])
+            codes = rng.choice(len(pool), size=int(n_codes.sum()), p=weights)
+            seps = rng.integers(0, len(SEPARATORS), size=n)
+            keys = rng.integers(1, n_patients + 1, size=n)
+            sexes = rng.choice(["M", "F"], size=n)
+            ages = rng.integers(18, 100, size=n)
+            insts = institutions[rng.integers(0, len(institutions), size=n)]
+            dates = (first_day + rng.integers(0, n_days + 1, size=n)).astype(str)
+            ends = np.cumsum(n_codes)
+            lines = []
+            for i in range(n):
+                cell = SEPARATORS[seps[i]].join(pool[c] for c in codes[ends[i] - n_codes[i]:ends[i]])
+                lines.append(f'{keys[i]},{sexes[i]},{ages[i]},{insts[i]},"{cell}",{dates[i]}\n')
+            out.write("".join(lines))
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate a synthetic HA dx extract.")
+    parser.add_argument("output", help="csv file to write")
+    parser.add_argument("--rows", type=int, default=10_000, help="number of rows (default: 10000)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args(argv)
+    generate(args.output, args.rows, args.seed)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
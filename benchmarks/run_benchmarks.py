@@ -0,0 +1,138 @@
+#Developed by ODAT project
+#please see https://odat.info
+#please see https://github.com/ODAT-Project
+"""
+throughput benchmarks for icd9-dx-builder.py on synthetic dx extracts.
+for each size two cases are measured, each in a fresh process so peak
+rss belongs to that case alone:
+  - matcher: classify_bits over an in-memory diagnosis column
+  - end-to-end: process_file from input csv to output csv
+rows/sec, peak rss and output size are compared against stored baselines;
+a case slower or bigger than its baseline by more than the tolerance
+counts as a regression and makes the run exit with status 1.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+#benchmark sizes by name
+SIZES = {"10k": 10_000, "1M": 1_000_000, "10M": 10_000_000}
+
+CASES = ["matcher", "end-to-end"]
+
+def run_case(case: str, input_path: str, workers: int) -> dict:
+    """run one case in this process and return its measurements."""
+    import pandas as pd
+    from generate_dx import load_builder
+
+    builder = load_builder()
+    cache = builder.CodeMaskCache(builder.CATEGORY_INDEX)
+    if case == "matcher":
+        dx_codes = pd.read_csv(input_path, usecols=["All Diagnosis Code (ICD9)"], dtype=str)["All Diagnosis Code (ICD9)"]
+        start = time.perf_counter()
+        builder.classify_bits(dx_codes, cache)
+        elapsed = time.perf_counter() - start
+        n_rows = len(dx_codes)
+        output_bytes = None
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            save_path = os.path.join(tmp, "out.csv")
+            start = time.perf_counter()
+            n_rows = builder.process_file(input_path, save_path, chunksize=builder.DEFAULT_CHUNK_SIZE,
+                                          workers=workers, cache=cache)
+            elapsed = time.perf_counter() - start
+            output_bytes = os.path.getsize(save_path)
+    peak = builder.peak_rss_mb()
+    return {
+        "rows": n_rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_sec": round(n_rows / elapsed),
+        "peak_rss_mb": round(peak, 1) if peak else None,
+        "output_bytes": output_bytes,
+    }
+
+def compare(name: str, result: dict, baseline: dict, tolerance: float) -> list:
+    """return the regressions of result against baseline."""
+    problems = []
+    if baseline.get("rows_per_sec") and result["rows_per_sec"] < baseline["rows_per_sec"] * (1 - tolerance):
+        problems.append(f"{name}: {result['rows_per_sec']:.0f} rows/s, baseline {baseline['rows_per_sec']:.0f}")
+    if baseline.get("peak_rss_mb") and result["peak_rss_mb"] and result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        problems.append(f"{name}: peak rss {result['peak_rss_mb']:.0f} MB, baseline {baseline['peak_rss_mb']:.0f} MB")
+    if baseline.get("output_bytes") and result["output_bytes"] and result["output_bytes"] > baseline["output_bytes"] * (1 + tolerance):
+        problems.append(f"{name}: output {result['output_bytes']} bytes, baseline {baseline['output_bytes']}")
+    return problems
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark icd9-dx-builder.py on synthetic dx extracts.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES), default=["10k", "1M"],
+                        help="input sizes to run (default: 10k 1M)")
+    parser.add_argument("--seed", type=int, default=0, help="generator seed (default: 0)")
+    parser.add_argument("--workers", type=int, default=1, help="workers for the end-to-end case (default: 1)")
+    parser.add_argument("--data-dir", default=os.path.join(HERE, "data"),
+                        help="where generated inputs are cached (default: benchmarks/data)")
+    parser.add_argument("--baselines", default=os.path.join(HERE, "baselines.json"),
+                        help="baseline file to compare against (default: benchmarks/baselines.json)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed slowdown/growth before a regression is reported (default: 0.25)")
+    parser.add_argument("--update-baselines", action="store_true", help="store this run as the new baselines")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--run-case", choices=CASES, help=argparse.SUPPRESS)
+    parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    #child process: measure a single case and report it as json
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.input, args.workers)))
+        return 0
+
+    from generate_dx import generate
+
+    os.makedirs(args.data_dir, exist_ok=True)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    results = {}
+    problems = []
+    print(f"{'case':<16}{'rows':>12}{'rows/s':>14}{'peak MB':>10}{'output MB':>11}")
+    for size in args.sizes:
+        input_path = os.path.join(args.data_dir, f"dx_{size}_seed{args.seed}.csv")
+        if not os.path.exists(input_path):
+            generate(input_path, SIZES[size], args.seed)
+        for case in CASES:
+            name = f"{case}/{size}"
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run-case", case, "--input", input_path,
+                 "--workers", str(args.workers)],
+                capture_output=True, text=True, check=True,
+            )
+            result = json.loads(proc.stdout.splitlines()[-1])
+            results[name] = result
+            output_mb = f"{result['output_bytes'] / (1 << 20):.1f}" if result["output_bytes"] else "-"
+            peak_mb = f"{result['peak_rss_mb']:.0f}" if result["peak_rss_mb"] else "-"
+            print(f"{name:<16}{result['rows']:>12}{result['rows_per_sec']:>14.0f}{peak_mb:>10}{output_mb:>11}")
+            if name in baselines:
+                problems.extend(compare(name, result, baselines[name], args.tolerance))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.update_baselines:
+        baselines.update(results)
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2)
+        print(f"baselines written to {args.baselines}")
+        return 0
+    for problem in problems:
+        print(f"regression: {problem}", file=sys.stderr)
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,314 +1,641 @@
 #Developed by ODAT project
 #please see https://odat.info
 #please see https://github.com/ODAT-Project
-import re
-import pandas as pd
-from tkinter import Tk, filedialog, messagebox, Button
+#heavy modules (pandas, numpy, tkinter) are imported where they are used,
+#so the command line starts fast and batch runs never load tkinter
+#the category matching itself lives in icd9_dx.py next to this script
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING
 
-#function to check icd9 code matches
-def icd9_matches(code: str, code_list: list) -> bool:
+if TYPE_CHECKING:
+    #annotations only, the runtime imports stay lazy
+    import numpy as np
+    import pandas as pd
+
+#re-exported, so code that loads this script as a module keeps working
+from icd9_dx import (  # noqa: F401
+    ALL_CATEGORIES,
+    CATEGORY_INDEX,
+    CODE_CACHE,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    EXCEL_EXTENSIONS,
+    MACE_CATEGORY_NAMES,
+    MACE_MASK,
+    READ_ENGINES,
+    REQUIRED_COLS,
+    CategoryDefinitionError,
+    CategoryIndex,
+    CodeMaskCache,
+    MissingColumnError,
+    SparseDx,
+    _any_bits,
+    _group_masks,
+    _read_arrow_chunks,
+    _read_chunks,
+    _stage,
+    classify_bits,
+    classify_codes,
+    classify_sparse,
+    compile_category_file,
+    default_artifact_dir,
+    first_events,
+    icd9_matches,
+    load_category_definitions,
+    save_category_definitions,
+)
+
+#peak resident memory of this process (or its largest finished child) in MB,
+#None where unsupported
+def peak_rss_mb(children: bool = False) -> float:
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+    #bytes on macos, kilobytes elsewhere
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / 1024
+
+#opt-in instrumentation of a processing run
+class RunReport:
+    """
+    collects per-stage timings and counts for one run:
+      - wall time and calls per stage (read, tokenize, match, write)
+      - rows, rows/sec and peak memory
+      - distinct codes seen and rows hit per category and for MACE
+    stage times from worker processes are summed, so with workers > 1
+    they are cpu time rather than wall time.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.rows = 0
+        self.codes = set()
+        self.category_hits = None
+        self.mace_hits = 0
+        self._start = time.perf_counter()
+        self._data = None
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += time.perf_counter() - start
+            stage["calls"] += 1
+
+    def count_hits(self, row_bits: np.ndarray, n_cats: int):
+        """add the rows hit per category in a block of packed row bits."""
+        import numpy as np
+
+        self._add_hits(np.unpackbits(row_bits, axis=1, count=n_cats, bitorder="little").sum(axis=0, dtype=np.int64))
+
+    def _add_hits(self, hits):
+        self.category_hits = hits if self.category_hits is None else self.category_hits + hits
+
+    def merge(self, other: RunReport):
+        """fold in the counts of a report made in a worker process."""
+        for name, stage in other.stages.items():
+            mine = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            mine["seconds"] += stage["seconds"]
+            mine["calls"] += stage["calls"]
+        self.codes |= other.codes
+        if other.category_hits is not None:
+            self._add_hits(other.category_hits)
+        self.mace_hits += other.mace_hits
+
+    def finish(self, categories: list, cache: CodeMaskCache = None, **extra) -> dict:
+        """stop the clock and return the report as a json-ready dict."""
+        wall = time.perf_counter() - self._start
+        hits = self.category_hits if self.category_hits is not None else [0] * len(categories)
+        peak = peak_rss_mb()
+        self._data = {
+            **extra,
+            "rows": self.rows,
+            "wall_seconds": round(wall, 3),
+            "rows_per_sec": round(self.rows / wall) if wall else None,
+            "peak_rss_mb": round(peak, 1) if peak else None,
+            "stages": {
+                name: {
+                    "seconds": round(stage["seconds"], 3),
+                    "calls": stage["calls"],
+                    "share": round(stage["seconds"] / wall, 3) if wall else None,
+                }
+                for name, stage in self.stages.items()
+            },
+            "distinct_codes": len(self.codes),
+            "mace_hits": self.mace_hits,
+            "category_hits": {cat: int(n) for cat, n in zip(categories, hits)},
+        }
+        if extra.get("workers", 1) > 1:
+            worker_peak = peak_rss_mb(children=True)
+            self._data["worker_peak_rss_mb"] = round(worker_peak, 1) if worker_peak else None
+        if cache is not None:
+            self._data["code_cache"] = cache.stats()
+        return self._data
+
+    def write(self, path: str):
+        """write the finished report as json."""
+        with open(path, "w") as f:
+            json.dump(self._data, f, indent=2)
+
+    def summary(self) -> str:
+        """short human readable summary of the finished report."""
+        data = self._data
+        lines = [f"{data['rows']} rows in {data['wall_seconds']:.1f} s ({data['rows_per_sec'] or 0} rows/s)"]
+        if data["peak_rss_mb"]:
+            lines.append(f"peak memory: {data['peak_rss_mb']:.0f} MB")
+        for name, stage in data["stages"].items():
+            lines.append(f"{name}: {stage['seconds']:.2f} s")
+        lines.append(f"distinct codes: {data['distinct_codes']}, MACE rows: {data['mace_hits']}")
+        top = sorted(data["category_hits"].items(), key=lambda item: -item[1])[:5]
+        lines.append("top categories: " + ", ".join(f"{cat} ({n})" for cat, n in top if n))
+        return "\n".join(lines)
+
+#column holding the packed category bits in the packed layout
+PACKED_COLUMN = "Category Bits"
+
+#classify one block of rows into the output layout
+def build_output(chunk: pd.DataFrame, matcher: CodeMaskCache = None, mace_mask: int = None,
+                 packed: bool = False, report: RunReport = None) -> pd.DataFrame:
     """
-    check if a given code matches any code in code_list.
-    supports:
-      - exact matches (e.g., '410.01' == '410.01')
-      - partial decimal matches (e.g., '410' matches '410.01')
-      - numeric ranges (e.g., '430-438') if present in code_list
+    return key, one flag column per group (MACE), date and one flag column
+    per category for chunk.
+    with packed set, the category columns are replaced by a single
+    PACKED_COLUMN holding each row's category bits as bytes (see
+    classify_bits).
     """
-    code = code.strip()
-    for c in code_list:
-        c = c.strip()
-        #if c is a range like '430-438'
-        if '-' in c:
+    import pandas as pd
+
+    if matcher is None:
+        matcher = CODE_CACHE
+    groups = _group_masks(matcher, mace_mask)
+    if packed:
+        row_bits = classify_bits(chunk["All Diagnosis Code (ICD9)"], matcher, report)
+        flags = {name: pd.Series(_any_bits(row_bits, mask), index=chunk.index) for name, mask in groups.items()}
+        if report is not None and "MACE" in flags:
+            report.mace_hits += int(flags["MACE"].sum())
+        return pd.DataFrame({
+            "Reference Key": chunk["Reference Key"],
+            **flags,
+            "Reference Date": chunk["Reference Date"],
+            PACKED_COLUMN: pd.Series([bytes(r) for r in row_bits], index=chunk.index, dtype=object),
+        })
+    flags = classify_codes(chunk["All Diagnosis Code (ICD9)"], matcher, mace_mask, report)
+    chunk = pd.concat([chunk[["Reference Key", "Reference Date"]], flags], axis=1)
+    return chunk[["Reference Key", *groups, "Reference Date", *matcher.categories]]
+
+#output formats by file extension
+OUTPUT_FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+def output_format(save_path: str) -> str:
+    """return the output format implied by save_path, csv when unknown."""
+    return OUTPUT_FORMATS.get(os.path.splitext(save_path)[1].lower(), "csv")
+
+def _render_csv(df: pd.DataFrame, header: bool) -> str:
+    #packed bits are written to csv as hex strings
+    if PACKED_COLUMN in df.columns:
+        df = df.assign(**{PACKED_COLUMN: df[PACKED_COLUMN].map(bytes.hex)})
+    return df.to_csv(index=False, header=header)
+
+#appends classified chunks to the output file
+class OutputWriter:
+    """
+    writes output chunks to save_path as csv, parquet or feather.
+    parquet and feather need pyarrow; each chunk becomes a compressed
+    row group / record batch, so the file is still written incrementally.
+    """
+
+    def __init__(self, save_path: str, fmt: str = "csv", compression: str = "zstd", append: bool = False):
+        if fmt not in ("csv", "parquet", "feather"):
+            raise ValueError(f"unknown output format '{fmt}'")
+        if append and fmt != "csv":
+            raise ValueError("only csv output can be appended to")
+        self.fmt = fmt
+        self.save_path = save_path
+        self.compression = compression
+        #an appended file already has its header
+        self.header = not append
+        self._writer = None
+        self._schema = None
+        if fmt == "csv":
+            self._file = open(save_path, "a" if append else "w", newline="")
+        else:
             try:
-                start_val = float(c.split('-')[0])
-                end_val = float(c.split('-')[1])
-                code_val = float(code)
-                if start_val <= code_val <= end_val:
-                    return True
-            except ValueError:
-                pass
+                import pyarrow  # noqa: F401
+            except ImportError as e:
+                raise ImportError(f"{fmt} output requires pyarrow (pip install pyarrow)") from e
+
+    def write(self, chunk):
+        """write an output frame, or csv text already rendered by a worker."""
+        if self.fmt == "csv":
+            if not isinstance(chunk, str):
+                chunk = _render_csv(chunk, self.header)
+            self._file.write(chunk)
         else:
-            #exact or partial match
-            if code == c or code.startswith(c + "."):
-                return True
+            self._write_arrow(chunk)
+        self.header = False
+
+    def _write_arrow(self, chunk: pd.DataFrame):
+        import pyarrow as pa
+
+        if self._writer is None:
+            schema = pa.Table.from_pandas(chunk, preserve_index=False).schema
+            #an all-empty first chunk must not fix a column to the null type
+            for i, field in enumerate(schema):
+                if pa.types.is_null(field.type):
+                    schema = schema.set(i, field.with_type(pa.string()))
+            if self.fmt == "parquet":
+                import pyarrow.parquet as pq
+
+                self._writer = pq.ParquetWriter(self.save_path, schema, compression=self.compression)
+            else:
+                options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                self._writer = pa.ipc.new_file(self.save_path, schema, options=options)
+            self._schema = schema
+        table = pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self.fmt == "csv":
+            self._file.close()
+        elif self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#compiled index and code cache held by each worker process, set once by _init_worker
+_worker_state = None
+
+def _init_worker(index: CategoryIndex, cache_size: int):
+    global _worker_state
+    _worker_state = CodeMaskCache(index, cache_size)
+
+def _format_block(block: pd.DataFrame, header: bool, fmt: str, packed: bool, collect: bool) -> tuple:
+    #runs in a worker: classify the block, rendered as csv text for csv
+    #output, along with the cache counters it added and, when collect is
+    #set, a report of its own
+    cache = _worker_state
+    report = RunReport() if collect else None
+    before = (cache.hits, cache.misses, cache.evictions)
+    result = build_output(block, cache, packed=packed, report=report)
+    if fmt == "csv":
+        with _stage(report, "write"):
+            result = _render_csv(result, header)
+    counts = tuple(after - b for after, b in zip((cache.hits, cache.misses, cache.evictions), before))
+    return result, counts, report
+
+def _timed(items, report: RunReport, name: str):
+    #iterate items, timing each step as a stage of report
+    items = iter(items)
+    while True:
+        with _stage(report, name):
+            item = next(items, None)
+        if item is None:
+            return
+        yield item
+
+class ProcessingCancelled(Exception):
+    """raised by process_file when its cancel event is set."""
+
+#rough number of data rows in file_path, for progress estimates
+def estimate_rows(file_path: str, cancel: threading.Event = None) -> int:
+    """
+    count the lines of a csv input (quoted line breaks count too), or read
+    the sheet dimensions of an .xlsx input. returns 0 when unknown.
+    setting cancel stops the count with ProcessingCancelled.
+    """
+    if file_path.lower().endswith(EXCEL_EXTENSIONS):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(file_path, read_only=True)
+        try:
+            return max((wb.worksheets[0].max_row or 0) - 1, 0)
+        finally:
+            wb.close()
+    lines = 0
+    last = b"\n"
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            if cancel is not None and cancel.is_set():
+                raise ProcessingCancelled(f"processing of {file_path} was cancelled")
+            lines += block.count(b"\n")
+            last = block[-1:]
+    #a last line without a newline still counts, the header doesn't
+    return max(lines + (last != b"\n") - 1, 0)
+
+def format_progress(rows: int, total: int, elapsed: float) -> str:
+    """progress line: rows done, rows/sec and, when total is known, an eta."""
+    rate = rows / elapsed if elapsed > 0 else 0.0
+    if not total:
+        return f"{rows:,} rows, {rate:,.0f} rows/s"
+    text = f"{rows:,} of ~{total:,} rows, {rate:,.0f} rows/s"
+    if rate > 0:
+        minutes, seconds = divmod(int(round(max(total - rows, 0) / rate)), 60)
+        text += f", eta {minutes}:{seconds:02d}"
+    return text
+
+#classify row blocks and write them to out, in input order
+def _write_blocks(out: OutputWriter, chunks, chunksize: int, workers: int, cache: CodeMaskCache,
+                  packed: bool, report: RunReport = None, written=None) -> int:
+    """
+    the classify/write loop shared by process_file and process_incremental.
+    chunks are the frames of _read_chunks (a one-frame list when chunksize
+    is None). with workers > 1, row blocks are classified in a process pool
+    and written back in order. written, if given, is called with the rows
+    written so far after each block. returns the number of rows.
+    """
+    n_rows = 0
+    if workers == 1:
+        for chunk in _timed(chunks, report, "read"):
+            result = build_output(chunk, cache, packed=packed, report=report)
+            with _stage(report, "write"):
+                out.write(result)
+            n_rows += len(chunk)
+            if written is not None:
+                written(n_rows)
+        return n_rows
+
+    if not chunksize:
+        #shard the whole frame into row blocks
+        df = chunks[0]
+        chunks = (df.iloc[i:i + DEFAULT_CHUNK_SIZE] for i in range(0, max(len(df), 1), DEFAULT_CHUNK_SIZE))
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(cache.index, cache.maxsize)) as pool:
+        #keep a bounded number of blocks in flight, write them in order
+        def write_next():
+            nonlocal n_written
+            block_rows, future = pending.popleft()
+            result, counts, block_report = future.result()
+            with _stage(report, "write"):
+                out.write(result)
+            cache.add_counts(*counts)
+            if report is not None:
+                report.merge(block_report)
+            n_written += block_rows
+            if written is not None:
+                written(n_written)
+
+        pending = deque()
+        n_written = 0
+        #an appended csv already has its header
+        header = out.header
+        try:
+            for chunk in _timed(chunks, report, "read"):
+                block = chunk[REQUIRED_COLS]
+                pending.append((len(block), pool.submit(_format_block, block, header, out.fmt, packed,
+                                                        report is not None)))
+                header = False
+                n_rows += len(block)
+                if len(pending) >= 2 * workers:
+                    write_next()
+            while pending:
+                write_next()
+        except BaseException:
+            #don't wait for blocks that will never be written
+            for _, future in pending:
+                future.cancel()
+            raise
+    return n_rows
+
+#read, classify and write a file, optionally in bounded chunks
+def process_file(file_path: str, save_path: str, chunksize: int = None, workers: int = 1,
+                 cache: CodeMaskCache = None, fmt: str = None, packed: bool = False,
+                 compression: str = "zstd", report: RunReport = None, engine: str = "c",
+                 progress=None, cancel: threading.Event = None) -> int:
+    """
+    classify every row of file_path and write the output to save_path.
+    with chunksize set, the input is read chunksize rows at a time and each
+    classified chunk is appended to save_path, so peak memory depends on the
+    chunk size rather than the file size. the header is written once.
+    with workers > 1, row blocks (the chunks, or DEFAULT_CHUNK_SIZE slices of
+    the whole file) are classified in a process pool and written back in
+    input order; the output is byte-identical to workers=1.
+    code lookups go through cache (CODE_CACHE by default); workers keep
+    their own caches of the same size and add their counters to it.
+    fmt is 'csv', 'parquet' or 'feather' (from save_path by default), with
+    compression applying to the latter two; packed selects the bit-packed
+    layout of build_output.
+    only REQUIRED_COLS are read; engine picks the csv parser of
+    _read_chunks, and .xlsx inputs are streamed from the workbook.
+    with report set, stage timings and counts are collected into it and
+    written as json to save_path + '.report.json'.
+    the output is written to a temporary file next to save_path and renamed
+    into place when complete, so a failed or cancelled run leaves any
+    existing save_path untouched. progress, if given, is called with the
+    number of rows written after each block; setting cancel stops the run
+    between blocks with ProcessingCancelled.
+    returns the number of rows processed.
+    """
+    import pandas as pd
+
+    if cache is None:
+        cache = CODE_CACHE
+    if fmt is None:
+        fmt = output_format(save_path)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+
+    with _stage(report, "read"):
+        chunks = _read_chunks(file_path, chunksize, engine)
+
+    def written(n_rows):
+        if progress is not None:
+            progress(n_rows)
+        if cancel is not None and cancel.is_set():
+            raise ProcessingCancelled(f"processing of {file_path} was cancelled")
+
+    tmp_path = f"{save_path}.{os.getpid()}.tmp"
+    try:
+        with OutputWriter(tmp_path, fmt, compression) as out:
+            n_rows = _write_blocks(out, chunks, chunksize, workers, cache, packed, report, written)
+            if out.header:
+                out.write(build_output(pd.DataFrame({rc: pd.Series(dtype=str) for rc in REQUIRED_COLS}), cache, packed=packed))
+        os.replace(tmp_path, save_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    if report is not None:
+        report.rows = n_rows
+        report.finish(cache.categories, cache, input=file_path, output=save_path, workers=workers)
+        report.write(save_path + ".report.json")
+    return n_rows
+
+
+#bump when the incremental state file layout changes
+STATE_VERSION = 1
+
+def _hash_bytes(digest, f, n_bytes: int):
+    #feed the next n_bytes of f into digest
+    while n_bytes > 0:
+        block = f.read(min(n_bytes, 1 << 20))
+        if not block:
+            break
+        digest.update(block)
+        n_bytes -= len(block)
+
+def _has_rows(f, n_bytes: int) -> bool:
+    #whether the next n_bytes of f hold anything but blank lines
+    while n_bytes > 0:
+        block = f.read(min(n_bytes, 1 << 20))
+        if not block:
+            break
+        if block.strip():
+            return True
+        n_bytes -= len(block)
     return False
 
-#define all categories
-ALL_CATEGORIES = {
-    # ------------------------ MACE Categories (Existing) ------------------------
-    "Acute myocardial infarction": [
-        "410", "410.01", "410.02", "410.1", "410.11", "410.12", "410.2", "410.21", "410.22",
-        "410.3", "410.31", "410.32", "410.4", "410.41", "410.42", "410.5", "410.51", "410.52",
-        "410.6", "410.61", "410.62", "410.7", "410.71", "410.72", "410.8", "410.81", "410.82",
-        "410.9", "410.91", "410.92"
-    ],
-    "Heart failure": [
-        "428", "428.1", "428.2", "428.21", "428.22", "428.23",
-        "428.3", "428.31", "428.32", "428.33", "428.4", "428.41", "428.42",
-        "428.43", "428.9", "398.91", "402.01", "402.11", "402.91",
-        "404.01", "404.03", "404.11", "404.13", "404.91", "404.93"
-    ],
-    "Stroke/transient ischemic attack": [
-        "435", "435.1", "435.2", "435.3", "435.8", "435.9",
-        "433.81", "433.91", "434", "436", "437", "437.1",
-        "433.31", "433.01", "434.01", "434.1", "434.11", "434.9",
-        "434.91", "437.2", "437.3", "437.4", "437.5", "437.6",
-        "437.7", "437.8", "437.9", "430", "431", "432",
-        "432.1", "432.9"
-    ],
-
-    # ------------------------ Additional Categories (Existing) ------------------------
-    "Atrial fibrillation": ["427.31"],
-    "Atrial flutter": ["427.32"],
-    "Ventricular tachycardia": ["427.1"],
-    "Ventricular fibrillation": ["427.0"], # Note: ICD-9 427.0 is Cardiac arrest, 427.4 is Ventricular fibrillation
-    "Cerebral embolism": ["434.1"], # This is already in Stroke/TIA, "434.1" = Cerebral embolism
-    "Pulmonary embolism and infarction": ["415.1"], # Can be expanded: "415.11", "415.12", "415.13", "415.19"
-    "Chronic pulmonary embolism": ["416.2"],
-    "Phlebitis and thrombophlebitis of deep veins of lower extremities": ["451.1"], # Can be expanded: "451.11", "451.19"
-    "Phlebitis and thrombophlebitis of lower extremities, unspecified": ["451.2"],
-    "Phlebitis and thrombophlebitis of iliac vein": ["451.81"],
-    "Phlebitis and thrombophlebitis of deep veins of upper extremities": ["451.83"],
-    "Phlebitis and thrombophlebitis of other sites": ["451.89"],
-    "Phlebitis and thrombophlebitis of unspecified site": ["451.9"],
-    "Thrombophlebitis migrans": ["453.1"],
-    "Other venous embolism and thrombosis of inferior vena cava": ["453.2"],
-    "Acute venous embolism and thrombosis of deep vessels of lower extremity": ["453.4", "453.40", "453.41", "453.42"], # Expanded
-    "Chronic venous embolism and thrombosis of deep vessels of lower extremity": ["453.5", "453.50", "453.51", "453.52"], # Expanded
-    "Chronic venous embolism and thrombosis of other specified vessels": ["453.7"],
-    "Acute venous embolism and thrombosis of other specified veins": ["453.8"],
-    "Acute venous embolism and thrombosis of unspecified site": ["453.9"],
-    "Old myocardial infarction": ["412"],
-    "Occlusion and stenosis of basilar artery with cerebral infarction": ["433.01"],
-    "Occlusion and stenosis of carotid artery with cerebral infarction": ["433.11"],
-    "Occlusion and stenosis of vertebral artery with cerebral infarction": ["433.21"],
-    "Occlusion and stenosis of multiple and bilateral precerebral arteries with cerebral infarction": ["433.31"],
-    "Occlusion and stenosis of other specified precerebral artery with cerebral infarction": ["433.81"],
-    "Occlusion and stenosis of unspecified precerebral artery with cerebral infarction": ["433.91"],
-    "Cerebral thrombosis": ["434"], # Can be expanded: "434.0", "434.00", "434.01", "434.9", "434.90", "434.91"
-    "Acute but ill-defined cerebrovascular disease": ["436"],
-    "Cerebral atherosclerosis": ["437.0"],
-    "Other generalized ischemic cerebrovascular disease": ["437.1"],
-    "Cerebrovascular disease (430-438)": ["430-438"], # This is a range, specific codes are often more useful for analysis.
-    "Transient cerebral ischemia": ["435"], # Covered in Stroke/TIA
-    "Diabetes mellitus": ["250", "250.0", "250.00", "250.01", "250.02", "250.03", "250.1", "250.10", "250.11", "250.12", "250.13", "250.2", "250.3", "250.4", "250.5", "250.6", "250.7", "250.8", "250.9"], # Expanded
-    "Hyperlipidaemia": ["272.0", "272.1", "272.2", "272.3", "272.4"],
-    "Unspecified essential hypertension": ["401.9"], # Consider also "401.0" Malignant, "401.1" Benign
-    "Essential hypertension": ["401", "401.0", "401.1", "401.9"], # Added broader and specified
-    "Aortic aneurysm and dissection": ["441", "441.0", "441.00", "441.01", "441.02", "441.03", "441.1", "441.2", "441.3", "441.4", "441.5", "441.6", "441.7", "441.9"], # Expanded
-    "Peripheral vascular disease, unspecified": ["443.9"], # Consider specific PVDs like "440.2" Atherosclerosis of native arteries of the extremities
-    "Atherosclerosis of extremities": ["440.2", "440.20", "440.21", "440.22", "440.23", "440.24", "440.29"],
-    "Gangrene": ["785.4"],
-    "Blood vessel replaced by other means": ["V43.4"],
-    "Arterial embolism and thrombosis": ["444", "444.0", "444.1", "444.2", "444.21", "444.22", "444.8", "444.81", "444.89", "444.9"], # Expanded
-    "Atheroembolism": ["445", "445.0", "445.01", "445.02", "445.8", "445.81", "445.82", "445.89"], # Expanded
-    "Chronic kidney disease": ["585", "585.1", "585.2", "585.3", "585.4", "585.5", "585.6", "585.9"], # Expanded to stages
-    "Chronic glomerulonephritis": ["582", "582.0", "582.1", "582.2", "582.4", "582.8", "582.81", "582.89", "582.9"],
-    "Nephritis and nephropathy not specified as acute or chronic": ["583", "583.0", "583.1", "583.2", "583.4", "583.8", "583.81", "583.89", "583.9"],
-    "Renal failure, unspecified": ["586"],
-    "Disorders resulting from impaired renal function": ["588", "588.0", "588.1", "588.8", "588.81", "588.89", "588.9"],
-    "Tetralogy of Fallot": ["745.2"],
-    "The heart chambers including univentricular heart": ["745.3"],
-    "Truncus arteriosus": ["745.0"],
-    "Transposition": ["745.1"],
-    "Ventricular septal defect": ["745.4"],
-    "Atrial septal defect": ["745.5"],
-    "Atrioventricular septal defect": ["745.6", "745.8"],
-    "Pulmonary or tricuspid valve": ["746.0", "746.1"],
-    "Aortic or mitral valve": ["746.3", "746.4", "746.5", "746.6"],
-    "The aorta or pulmonary arteries or great arteries/veins": ["747"],
-    "Other cardiac malformation": ["746.9", "746.7", "746.8", "745.7", "745.9"],
-
-    # ------------------------ NEW Common Respiratory Conditions ------------------------
-    "Acute nasopharyngitis (Common Cold)": ["460"],
-    "Acute sinusitis": ["461", "461.0", "461.1", "461.2", "461.3", "461.8", "461.9"],
-    "Acute pharyngitis": ["462"],
-    "Acute tonsillitis": ["463"],
-    "Acute laryngitis and tracheitis (incl Croup, Epiglottitis)": [
-        "464", "464.0", "464.00", "464.01", "464.1", "464.10", "464.11", "464.2", "464.20", "464.21",
-        "464.3", "464.30", "464.31", "464.4", "464.5", "464.50", "464.51"
-    ],
-    "Acute upper respiratory infections, multiple/unspecified": ["465", "465.0", "465.8", "465.9"],
-    "Acute bronchitis and bronchiolitis": ["466", "466.0", "466.1", "466.11", "466.19"],
-    "Influenza": ["487", "487.0", "487.1", "487.8"], # Can be "488" for novel influenza
-    "Pneumonia, organism unspecified": ["486"],
-    "Other bacterial pneumonia": ["482", "482.0", "482.1", "482.2", "482.3", "482.4", "482.8", "482.9"],
-    "Viral pneumonia": ["480", "480.0", "480.1", "480.2", "480.3", "480.8", "480.9"],
-    "Chronic sinusitis": ["473", "473.0", "473.1", "473.2", "473.3", "473.8", "473.9"],
-    "Chronic bronchitis": ["491", "491.0", "491.1", "491.2", "491.20", "491.21", "491.8", "491.9"],
-    "Emphysema": ["492", "492.0", "492.8"],
-    "Asthma": [
-        "493", "493.0", "493.00", "493.01", "493.02", "493.1", "493.10", "493.11", "493.12",
-        "493.2", "493.20", "493.21", "493.22", "493.8", "493.81", "493.82", "493.9", "493.90",
-        "493.91", "493.92"
-    ],
-    "Chronic obstructive pulmonary disease (COPD)": ["496"], # NEC; often primary codes 491.x, 492.x are used
-
-    # ------------------------ NEW Common Infections (Non-Respiratory) ------------------------
-    "Intestinal infectious diseases": ["008.45", "008.8", "009.0", "009.1", "009.2", "009.3"], # 008.45 C.diff
-    "Septicemia": [
-        "038", "038.0", "038.1", "038.10", "038.11", "038.12", "038.19", "038.2", "038.3", "038.4",
-        "038.40", "038.41", "038.42", "038.43", "038.44", "038.49", "038.8", "038.9"
-    ],
-    "Human Immunodeficiency Virus (HIV) infection and AIDS": ["042", "V08"], # V08 Asymptomatic HIV
-    "Viral hepatitis": ["070", "070.0", "070.1", "070.2", "070.20", "070.21", "070.22", "070.23", "070.3", "070.30", "070.31", "070.32", "070.33", "070.4", "070.41", "070.44", "070.5", "070.51", "070.54", "070.70", "070.71", "070.9"],
-    "Urinary tract infection, site not specified": ["599.0"],
-    "Candidiasis (Thrush, Yeast Infection)": ["112", "112.0", "112.1", "112.2", "112.3", "112.4", "112.5", "112.8", "112.9"],
-    "Herpes zoster (Shingles)": ["053", "053.0", "053.1", "053.10", "053.11", "053.12", "053.13", "053.19", "053.2", "053.7", "053.8", "053.9"],
-    "Cellulitis and abscess": [
-        "681", "681.0", "681.00", "681.01", "681.02", "681.1", "681.10", "681.11", "681.9", # Finger and toe
-        "682", "682.0", "682.1", "682.2", "682.3", "682.4", "682.5", "682.6", "682.7", "682.8", "682.9" # Other sites
-    ],
-
-    # ------------------------ NEW Common Mental Health Disorders ------------------------
-    "Dementia (incl Alzheimer's)": ["290", "290.0", "290.1", "290.10", "290.11", "290.12", "290.13", "290.2", "290.20", "290.21", "290.3", "290.4", "290.40", "290.41", "290.42", "290.43", "331.0"], # 331.0 Alzheimer's
-    "Schizophrenia spectrum disorders": [
-        "295", "295.0", "295.00", "295.1", "295.10", "295.2", "295.20", "295.3", "295.30", "295.4", "295.40",
-        "295.6", "295.60", "295.7", "295.70", "295.8", "295.80", "295.9", "295.90"
-    ],
-    "Major Depressive Disorder": [
-        "296.2", "296.20", "296.21", "296.22", "296.23", "296.24", "296.25", "296.26",
-        "296.3", "296.30", "296.31", "296.32", "296.33", "296.34", "296.35", "296.36"
-    ],
-    "Bipolar Disorder": [
-        "296.0", "296.00", "296.01", "296.02", "296.03", "296.04", "296.05", "296.06",
-        "296.1", "296.10", "296.11", "296.12", "296.13", "296.14", "296.15", "296.16",
-        "296.4", "296.40", "296.41", "296.42", "296.43", "296.44", "296.45", "296.46",
-        "296.5", "296.50", "296.51", "296.52", "296.53", "296.54", "296.55", "296.56",
-        "296.6", "296.60", "296.61", "296.62", "296.63", "296.64", "296.65", "296.66",
-        "296.7", "296.8", "296.80", "296.81", "296.82", "296.89", "296.9", "296.90", "296.99"
-    ],
-    "Anxiety Disorders (Generalized, Panic, Phobias)": [
-        "300.0", "300.00", "300.01", "300.02", "300.09", # Anxiety states
-        "300.2", "300.20", "300.21", "300.22", "300.23", "300.29"  # Phobic disorders
-    ],
-    "Obsessive-compulsive disorder": ["300.3"],
-    "Post-traumatic stress disorder (PTSD)": ["309.81"],
-    "Adjustment disorders": ["309", "309.0", "309.1", "309.2", "309.24", "309.28", "309.3", "309.4", "309.8", "309.89", "309.9"],
-    "Attention deficit disorder (ADD/ADHD)": ["314", "314.0", "314.00", "314.01", "314.1", "314.2", "314.8", "314.9"],
-    "Substance use disorders (Alcohol, Opioids, etc.)": [ # General categories, can be much more specific
-        "303", "303.0", "303.00", "303.9", "303.90", # Alcohol dependence
-        "304", "304.0", "304.00", "304.1", "304.10", "304.2", "304.20", # Drug dependence (Opioid, Cocaine, etc.)
-        "305", "305.0", "305.00", "305.2", "305.20", "305.5", "305.50", "305.6", "305.60" # Non-dependent abuse
-    ],
-
-    # ------------------------ NEW Common Digestive System Disorders ------------------------
-    "Gastroesophageal reflux disease (GERD)": ["530.11", "530.81"], # 530.11 Reflux esophagitis, 530.81 GERD
-    "Gastritis and duodenitis": [
-        "535", "535.0", "535.00", "535.01", "535.1", "535.10", "535.11", "535.3", "535.30", "535.31",
-        "535.4", "535.40", "535.41", "535.5", "535.50", "535.51", "535.6", "535.60", "535.61", "535.7"
-    ],
-    "Peptic ulcer disease": ["531", "531.0", "531.1", "531.2", "531.3", "531.4", "531.5", "531.6", "531.7", "531.9", # Gastric
-                              "532", "532.0", "532.1", "532.2", "532.3", "532.4", "532.5", "532.6", "532.7", "532.9", # Duodenal
-                              "533", # Peptic, site unspecified
-                              "534"], # Gastrojejunal
-    "Irritable bowel syndrome (IBS)": ["564.1"],
-    "Diverticulosis and Diverticulitis of colon": [
-        "562.00", "562.01", "562.02", "562.03", # Diverticulosis of small intestine
-        "562.10", "562.11", "562.12", "562.13"  # Diverticulosis/itis of colon
-    ],
-    "Constipation": ["564.0", "564.00", "564.01", "564.02", "564.09"],
-    "Hemorrhoids": ["455", "455.0", "455.2", "455.3", "455.5", "455.6", "455.8"],
-    "Appendicitis": ["540", "540.0", "540.1", "540.9", "541", "542"],
-    "Cholelithiasis and Cholecystitis (Gallstones)": [
-        "574", "574.0", "574.00", "574.01", "574.1", "574.10", "574.11", "574.2", "574.20", "574.21", # Cholelithiasis
-        "575.0", "575.1", "575.10", "575.11", "575.12" # Cholecystitis
-    ],
-    "Non-infectious gastroenteritis and colitis": ["558.9"],
-    "Chronic liver disease and cirrhosis": ["571", "571.0", "571.1", "571.2", "571.3", "571.4", "571.40", "571.41", "571.49", "571.5", "571.6", "571.8", "571.9"],
-
-    # ------------------------ NEW Common Musculoskeletal Conditions ------------------------
-    "Rheumatoid arthritis": ["714", "714.0", "714.1", "714.2", "714.30", "714.31", "714.32", "714.33", "714.4", "714.8", "714.89", "714.9"],
-    "Osteoarthritis": [
-        "715", "715.0", "715.00", "715.04", "715.09", "715.1", "715.10", "715.11", "715.12", "715.13", "715.14", "715.15", "715.16", "715.17", "715.18",
-        "715.2", "715.3", "715.8", "715.9", "715.90", "715.91", "715.92", "715.93", "715.94", "715.95", "715.96", "715.97", "715.98"
-    ],
-    "Low back pain (Lumbago)": ["724.2"],
-    "Sciatica": ["724.3"],
-    "Intervertebral disc disorders (Herniated disc, Degeneration)": [
-        "722", "722.0", "722.1", "722.10", "722.11", "722.2", # Cervical, Thoracic, Lumbar
-        "722.3", "722.30", "722.31", "722.32", "722.39", # Schmorl's nodes
-        "722.4", "722.5", "722.51", "722.52", # Degeneration
-        "722.6", # Postlaminectomy syndrome
-        "722.7", "722.70", "722.71", "722.72", "722.73", # Disc disorder with myelopathy
-        "722.8", "722.80", "722.81", "722.82", "722.83", # Other specified
-        "722.9", "722.90", "722.91", "722.92", "722.93"  # Unspecified
-    ],
-    "Osteoporosis": ["733.0", "733.00", "733.01", "733.02", "733.03", "733.09"],
-    "Gout": ["274", "274.0", "274.00", "274.01", "274.02", "274.03", "274.1", "274.8", "274.9"], # This is metabolic
-    "Carpal tunnel syndrome": ["354.0"],
-
-    # ------------------------ NEW Common Cancers ------------------------
-    "Malignant neoplasm of bronchus and lung": ["162", "162.0", "162.2", "162.3", "162.4", "162.5", "162.8", "162.9"],
-    "Malignant neoplasm of female breast": ["174", "174.0", "174.1", "174.2", "174.3", "174.4", "174.5", "174.6", "174.8", "174.9"],
-    "Malignant neoplasm of male breast": ["175", "175.0", "175.9"],
-    "Malignant neoplasm of prostate": ["185"],
-    "Malignant neoplasm of colon": ["153", "153.0", "153.1", "153.2", "153.3", "153.4", "153.5", "153.6", "153.7", "153.8", "153.9"],
-    "Malignant neoplasm of rectum, rectosigmoid, and anus": ["154", "154.0", "154.1", "154.2", "154.3", "154.8"],
-    "Malignant melanoma of skin": ["172", "172.0", "172.1", "172.2", "172.3", "172.4", "172.5", "172.6", "172.7", "172.8", "172.9"],
-    "Other malignant neoplasm of skin (Non-melanoma)": ["173", "173.0", "173.1", "173.2", "173.3", "173.4", "173.5", "173.6", "173.7", "173.8", "173.9"],
-    "Malignant neoplasm of bladder": ["188", "188.0", "188.1", "188.2", "188.3", "188.4", "188.5", "188.6", "188.7", "188.8", "188.9"],
-    "Malignant neoplasm of kidney and other urinary organs": ["189", "189.0", "189.1", "189.2", "189.3", "189.4", "189.8", "189.9"],
-    "Malignant neoplasm of thyroid gland": ["193"],
-    "Malignant neoplasm of brain": ["191", "191.0", "191.1", "191.2", "191.3", "191.4", "191.5", "191.6", "191.7", "191.8", "191.9"],
-    "Non-Hodgkin's lymphomas": [
-        "200", "200.0", "200.00", "200.1", "200.10", "200.2", "200.20", "200.8", "200.80",
-        "202", "202.0", "202.00", "202.1", "202.10", "202.2", "202.20", "202.8", "202.80", "202.9", "202.90"
-    ],
-    "Hodgkin's disease": ["201", "201.0", "201.00", "201.1", "201.10", "201.2", "201.20", "201.4", "201.40", "201.5", "201.50", "201.6", "201.60", "201.7", "201.70", "201.9", "201.90"],
-    "Leukemias": [
-        "204", "204.0", "204.00", "204.1", "204.10", "204.8", "204.9", # Lymphoid
-        "205", "205.0", "205.00", "205.1", "205.10", "205.3", "205.8", "205.9", # Myeloid
-        "206", # Monocytic
-        "207", # Other specified
-        "208", "208.0", "208.00", "208.1", "208.10", "208.8", "208.9"  # Unspecified cell type
-    ],
-    "Multiple Myeloma": ["203", "203.0", "203.00", "203.01", "203.8", "203.80", "203.81"],
-    "Secondary malignant neoplasm (Metastasis)": [ # General categories
-        "196", # Lymph nodes
-        "197", # Respiratory and digestive
-        "198", # Other specified sites (bone, brain, liver etc)
-        "199"  # Unspecified site
-    ],
-
-    # ------------------------ NEW Other Common Conditions ------------------------
-    "Anemias (Iron deficiency, other unspecified)": [
-        "280", "280.0", "280.1", "280.8", "280.9", # Iron deficiency
-        "281", # Other deficiency anemias (B12, Folate)
-        "285.1", # Acute posthemorrhagic anemia
-        "285.2", # Anemia in chronic disease
-        "285.8", # Other specified anemias
-        "285.9"  # Anemia, unspecified
-    ],
-    "Thyroid disorders (Hypothyroidism, Hyperthyroidism)": [
-        "242", "242.0", "242.00", "242.01", "242.1", "242.2", "242.3", "242.4", "242.8", "242.9", "242.90", "242.91", # Thyrotoxicosis
-        "244", "244.0", "244.1", "244.2", "244.3", "244.8", "244.9"  # Acquired hypothyroidism
-    ],
-    "Migraine": ["346", "346.0", "346.00", "346.01", "346.1", "346.10", "346.11", "346.2", "346.20", "346.21", "346.8", "346.80", "346.81", "346.9", "346.90", "346.91"],
-    "Other headache syndromes": ["784.0", "307.81", "339.0", "339.1", "339.2", "339.3", "339.4", "339.8"], # 784.0 Headache, 307.81 Tension headache
-    "Allergic rhinitis": ["477", "477.0", "477.1", "477.2", "477.8", "477.9"],
-    "Obesity": ["278.00", "278.01", "278.03"], # 278.00 Obesity NOS, 278.01 Morbid obesity, 278.03 Overweight
-    "Sleep apnea": ["327.23", "780.51", "780.53", "780.57"], # 327.23 Obstructive sleep apnea, others are symptoms like hypersomnia with sleep apnea
-    "Vertigo and Dizziness": ["780.4", "386.0", "386.1", "386.10", "386.11", "386.12", "386.19", "386.2"], # 780.4 Dizziness, 386 Meniere's disease etc.
-    "Syncope and collapse": ["780.2"],
-    "Edema": ["782.3"], # Generalized edema
-    "Peripheral neuropathies": ["356.9", "357.9"], # Unspecified polyneuropathy, Unspecified inflammatory and toxic neuropathy
-    "Glaucoma": ["365", "365.0", "365.1", "365.10", "365.11", "365.12", "365.2", "365.9"],
-    "Cataract": ["366", "366.0", "366.1", "366.10", "366.15", "366.16", "366.17", "366.9"],
-    "Benign prostatic hyperplasia (BPH)": ["600", "600.0", "600.00", "600.01", "600.1", "600.2", "600.9"]
-}
+#classify only the rows appended since the last run
+def process_incremental(file_path: str, save_path: str, chunksize: int = DEFAULT_CHUNK_SIZE, workers: int = 1,
+                        cache: CodeMaskCache = None, packed: bool = False, state_path: str = None,
+                        engine: str = "c") -> tuple:
+    """
+    like process_file with csv input and output (chunksize, workers and
+    engine work the same way, for rebuilds and appends alike), but rows of
+    file_path that were already processed are not classified again. a state file (save_path +
+    '.state.json' by default) records the number of input bytes processed,
+    a sha256 of those bytes, a hash of the category definitions and layout,
+    and the output size. later runs append only the rows past that
+    watermark. the output is rebuilt in full when there is no usable state
+    (missing, unreadable or from another version), when the processed
+    bytes changed, or when the categories changed.
+    output past the recorded size (an interrupted append) is dropped first.
+    returns (rows written by this run, whether it was a full rebuild).
+    """
+    import pandas as pd
 
-#MACE_CATEGORY_NAMES remains the same as per your definition
-MACE_CATEGORY_NAMES = [
-    "Acute myocardial infarction",
-    "Heart failure",
-    "Stroke/transient ischemic attack"
-]
+    if output_format(save_path) != "csv":
+        raise ValueError("incremental processing needs a csv output")
+    if file_path.lower().endswith(EXCEL_EXTENSIONS):
+        raise ValueError("incremental processing needs a csv input")
+    if engine not in READ_ENGINES:
+        raise ValueError(f"unknown engine '{engine}', expected one of {', '.join(READ_ENGINES)}")
+    if cache is None:
+        cache = CODE_CACHE
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    if state_path is None:
+        state_path = save_path + ".state.json"
+    definition = hashlib.sha256(f"{cache.index.fingerprint}:{int(packed)}".encode()).hexdigest()
+    input_bytes = os.path.getsize(file_path)
+
+    state = None
+    if os.path.exists(state_path) and os.path.exists(save_path):
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except ValueError:
+            state = None
+    resume = (
+        isinstance(state, dict)
+        and state.get("version") == STATE_VERSION
+        and state.get("definition") == definition
+        and isinstance(state.get("input_sha256"), str)
+        and all(isinstance(state.get(key), int) for key in ("input_bytes", "output_bytes", "rows"))
+        and state["input_bytes"] <= input_bytes
+        and state["output_bytes"] <= os.path.getsize(save_path)
+    )
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        if resume:
+            #the processed prefix must be unchanged, and new rows must start on a new line
+            _hash_bytes(digest, f, state["input_bytes"])
+            resume = digest.hexdigest() == state["input_sha256"]
+            if resume and state["input_bytes"] > 0:
+                f.seek(state["input_bytes"] - 1)
+                boundary = f.read(2)
+                resume = boundary[:1] == b"\n" or boundary[1:] in (b"", b"\n", b"\r")
+            f.seek(state["input_bytes"])
+            _hash_bytes(digest, f, input_bytes - state["input_bytes"])
+        else:
+            _hash_bytes(digest, f, input_bytes)
+
+    if not resume:
+        n_rows = process_file(file_path, save_path, chunksize, workers, cache, "csv", packed, engine=engine)
+        total_rows = n_rows
+    else:
+        with open(save_path, "r+b") as out:
+            out.truncate(state["output_bytes"])
+        columns = list(pd.read_csv(file_path, nrows=0).columns)
+        n_rows = 0
+        with open(file_path, "rb") as f, OutputWriter(save_path, "csv", append=True) as out:
+            f.seek(state["input_bytes"])
+            appended = _has_rows(f, input_bytes - state["input_bytes"])
+            f.seek(state["input_bytes"])
+            if appended:
+                #the appended rows have no header, name the columns ourselves
+                if engine == "pyarrow":
+                    chunks = _read_arrow_chunks(f, chunksize, columns)
+                else:
+                    chunks = pd.read_csv(f, header=None, names=columns, usecols=REQUIRED_COLS,
+                                         chunksize=chunksize, dtype={rc: str for rc in REQUIRED_COLS})
+                    if not chunksize:
+                        chunks = [chunks]
+                n_rows = _write_blocks(out, chunks, chunksize, workers, cache, packed)
+        total_rows = state["rows"] + n_rows
+
+    #record the new watermark, replacing the old state in one step
+    state = {
+        "version": STATE_VERSION,
+        "definition": definition,
+        "input_bytes": input_bytes,
+        "input_sha256": digest.hexdigest(),
+        "output_bytes": os.path.getsize(save_path),
+        "rows": total_rows,
+    }
+    with open(state_path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(state_path + ".tmp", state_path)
+    return n_rows, not resume
+
+def process_first_events(file_path: str, save_path: str, chunksize: int = DEFAULT_CHUNK_SIZE,
+                         cache: CodeMaskCache = None, last: bool = False, count: bool = False,
+                         fmt: str = None, compression: str = "zstd", engine: str = "c",
+                         date_format: str = None) -> tuple:
+    """
+    write first_events of file_path to save_path (csv, parquet or feather).
+    returns (number of (patient, category) rows written, number of matching
+    rows skipped for lack of a Reference Key or a parseable date).
+    """
+    result = first_events(file_path, chunksize, cache, last, count, engine, date_format)
+    with OutputWriter(save_path, fmt or output_format(save_path), compression) as out:
+        out.write(result)
+    return len(result), result.attrs["skipped_rows"]
 
 
 #define main app class
 class ICD9App:
     def __init__(self, root):
+        from tkinter import BooleanVar, Button, Checkbutton, Label, StringVar
+
         self.root = root
         self.root.geometry("600x300")
         self.root.title("ICD-9 DX Builder")
@@ -316,11 +643,45 @@ class ICD9App:
         #create select file button
         self.select_file_btn = Button(
             self.root,
-            text="Select CSV File",
+            text="Select CSV or Excel File",
             command=self.select_and_process_file
         )
         self.select_file_btn.pack(pady=10)
 
+        #progress of the running job, and a way to stop it
+        self.status_var = StringVar(value="")
+        self.status_label = Label(self.root, textvariable=self.status_var)
+        self.status_label.pack(pady=5)
+        self.cancel_btn = Button(
+            self.root,
+            text="Cancel",
+            command=self.cancel_processing,
+            state="disabled"
+        )
+        self.cancel_btn.pack(pady=5)
+        self._job = None
+        self._cancel = threading.Event()
+        self._closing = False
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+
+        #opt-in run report
+        self.report_var = BooleanVar(value=False)
+        self.report_check = Checkbutton(
+            self.root,
+            text="Write run report",
+            variable=self.report_var
+        )
+        self.report_check.pack(pady=5)
+
+        #categories in use, the built-in ones until a definition file is loaded
+        self.cache = CODE_CACHE
+        self.categories_btn = Button(
+            self.root,
+            text="Load Category Definitions",
+            command=self.load_categories
+        )
+        self.categories_btn.pack(pady=5)
+
         #create about button
         self.about_btn = Button(
             self.root,
@@ -330,73 +691,311 @@ class ICD9App:
         self.about_btn.pack(pady=5)
 
     def show_about(self):
+        from tkinter import messagebox
+
         #display about info
         messagebox.showinfo(
             "about",
             "ICD-9 DX Builder\nDeveloped by ODAT project."
         )
 
-    def select_and_process_file(self):
-        #ask user to select a file
-        file_path = filedialog.askopenfilename(
-            title="Select a CSV File",
-            filetypes=[("CSV Files", "*.csv"), ("All Files", "*.*")] 
+    def load_categories(self):
+        from tkinter import filedialog, messagebox
+
+        #ask for a json/yaml definition file
+        path = filedialog.askopenfilename(
+            title="Select Category Definitions",
+            filetypes=[("Category Definitions", "*.json *.yaml *.yml"), ("All Files", "*.*")]
         )
-        if not file_path:
-            messagebox.showinfo("no file selected", "please select a csv file.")
+        if not path:
             return
-
         try:
-            #read the csv file
-            df = pd.read_csv(file_path)
+            index = compile_category_file(path)
         except Exception as e:
-            messagebox.showerror("error", f"could not read csv file: {e}")
+            messagebox.showerror("error", f"could not load category definitions: {e}")
             return
+        self.cache = CodeMaskCache(index)
+        messagebox.showinfo("categories loaded", f"{len(index.categories)} categories loaded from {path}")
 
-        #check required cols
-        required_cols = ["Reference Key", "All Diagnosis Code (ICD9)", "Reference Date"]
-        for rc in required_cols:
-            if rc not in df.columns:
-                messagebox.showerror("missing column", f"the column '{rc}' is required but not found.")
-                return
+    def select_and_process_file(self):
+        from queue import Queue
+        from tkinter import filedialog, messagebox
 
-        #initialize category columns efficiently
-        new_cols = pd.DataFrame(
-            0,
-            index=df.index,
-            columns=list(ALL_CATEGORIES.keys()) + ["MACE"]
+        #ask user to select a file
+        file_path = filedialog.askopenfilename(
+            title="Select a CSV or Excel File",
+            filetypes=[("CSV Files", "*.csv"), ("Excel Files", "*.xlsx *.xlsm"), ("All Files", "*.*")]
         )
-        df = pd.concat([df, new_cols], axis=1)
-
-        #process each row
-        for i in range(len(df)):
-            row_codes = str(df.at[i, "All Diagnosis Code (ICD9)"])
-            split_codes = re.split(r"[^\w\.]", row_codes)
-            split_codes = [c for c in split_codes if c]
-            any_mace = False
-            for cat, code_list in ALL_CATEGORIES.items():
-                if any(icd9_matches(code, code_list) for code in split_codes):
-                    df.at[i, cat] = 1
-                    if cat in MACE_CATEGORY_NAMES:
-                        any_mace = True
-            df.at[i, "MACE"] = 1 if any_mace else 0
-
-        #prepare output columns
-        output_cols = ["Reference Key", "MACE", "Reference Date"] + list(ALL_CATEGORIES.keys())
+        if not file_path:
+            messagebox.showinfo("no file selected", "please select a csv or excel file.")
+            return
 
         #ask where to save file
         save_path = filedialog.asksaveasfilename(
-            title="Save Processed CSV",
+            title="Save Output",
             defaultextension=".csv",
-            filetypes=[("CSV Files", "*.csv")]
+            filetypes=[("CSV Files", "*.csv"), ("Parquet Files", "*.parquet"), ("Feather Files", "*.feather")]
         )
-        if save_path:
-            #save the processed csv
-            df[output_cols].to_csv(save_path, index=False)
-            messagebox.showinfo("success", f"processed csv saved to {save_path}")
+        if not save_path:
+            return
+
+        #run the job on a worker thread, the window polls it for progress
+        report = RunReport() if self.report_var.get() else None
+        self._cancel = threading.Event()
+        self._events = Queue()
+        self._job = threading.Thread(target=self._run_job, args=(file_path, save_path, report), daemon=True)
+        self.select_file_btn.config(state="disabled")
+        self.categories_btn.config(state="disabled")
+        self.cancel_btn.config(state="normal")
+        self.status_var.set("counting rows...")
+        self._job.start()
+        self.root.after(100, self._poll_job)
+
+    def _run_job(self, file_path, save_path, report):
+        #worker thread: never touches tk, only posts events for _poll_job
+        events = self._events
+        try:
+            total = estimate_rows(file_path, self._cancel)
+            started = time.perf_counter()
+            events.put(("progress", format_progress(0, total, 0.0)))
+
+            def progress(n_rows):
+                events.put(("progress", format_progress(n_rows, total, time.perf_counter() - started)))
+
+            #stream the file through the classifier, format follows the extension
+            n_rows = process_file(file_path, save_path, chunksize=DEFAULT_CHUNK_SIZE, cache=self.cache,
+                                  report=report, progress=progress, cancel=self._cancel)
+        except ProcessingCancelled:
+            events.put(("cancelled", None))
+        except Exception as e:
+            events.put(("error", e))
+        else:
+            events.put(("done", (save_path, n_rows, report)))
+
+    def _poll_job(self):
+        from queue import Empty
+        from tkinter import messagebox
+
+        while True:
+            try:
+                kind, value = self._events.get_nowait()
+            except Empty:
+                self.root.after(100, self._poll_job)
+                return
+            if kind == "progress":
+                #keep showing 'cancelling...' once cancel was asked for
+                if not self._cancel.is_set():
+                    self.status_var.set(value)
+                continue
+            break
+
+        self._job = None
+        if self._closing:
+            #the job has cleaned up, the window can go now
+            self.root.destroy()
+            return
+        self.select_file_btn.config(state="normal")
+        self.categories_btn.config(state="normal")
+        self.cancel_btn.config(state="disabled")
+        if kind == "cancelled":
+            self.status_var.set("cancelled, no output was written")
+            return
+        if kind == "error":
+            self.status_var.set("")
+            if isinstance(value, MissingColumnError):
+                messagebox.showerror("missing column", str(value))
+            else:
+                messagebox.showerror("error", f"could not process file: {value}")
+            return
+        save_path, n_rows, report = value
+        self.status_var.set(f"done, {n_rows:,} rows")
+        if report is not None:
+            messagebox.showinfo(
+                "success",
+                f"output saved to {save_path}\n\n{report.summary()}\n\nreport saved to {save_path}.report.json"
+            )
+            return
+        messagebox.showinfo("success", f"output saved to {save_path}")
+
+    def cancel_processing(self):
+        #the worker stops after the block it is on and removes its partial output
+        if self._job is not None:
+            self._cancel.set()
+            self.cancel_btn.config(state="disabled")
+            self.status_var.set("cancelling...")
+
+    def close(self):
+        #a running job is cancelled first and _poll_job closes the window once
+        #it has removed its temp file, so the window never blocks on it
+        if self._job is None:
+            self.root.destroy()
+            return
+        self._closing = True
+        self._cancel.set()
+        self.select_file_btn.config(state="disabled")
+        self.cancel_btn.config(state="disabled")
+        self.status_var.set("cancelling...")
+
+#default output path for an input file
+def default_output_path(file_path: str, output_dir: str = None, fmt: str = "csv", suffix: str = "_dx") -> str:
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(output_dir or os.path.dirname(file_path), f"{stem}{suffix}.{fmt}")
+
+#headless batch entry point
+def main(argv: list = None) -> int:
+    """
+    run the builder from the command line, or open the gui when no
+    arguments are given. returns the process exit code.
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+    if not argv:
+        from tkinter import Tk
+
+        root = Tk()
+        ICD9App(root)
+        root.mainloop()
+        return 0
+
+    import argparse
+    import glob
+
+    parser = argparse.ArgumentParser(
+        description="Build ICD-9 dx event flags for HA raw dx data. Run without arguments to open the GUI."
+    )
+    parser.add_argument("inputs", nargs="*", metavar="INPUT", help="input csv or .xlsx file(s) or glob pattern(s)")
+    parser.add_argument("-o", "--output", help="output csv file (single input) or output directory; "
+                        "defaults to <input>_dx.csv next to each input")
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help=f"rows read per chunk, 0 loads each file at once (default: {DEFAULT_CHUNK_SIZE})")
+    parser.add_argument("--engine", choices=READ_ENGINES, default="c",
+                        help="csv parser: pandas' c parser, or pyarrow's faster multithreaded one "
+                        "(default: c)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes for classification, 0 uses all cores (default: 1)")
+    parser.add_argument("--format", choices=["csv", "parquet", "feather"],
+                        help="output format (default: from the output extension, else csv); "
+                        "parquet and feather need pyarrow")
+    parser.add_argument("--compression", default="zstd",
+                        help="parquet/feather compression codec (default: zstd)")
+    parser.add_argument("--packed", action="store_true",
+                        help=f"write all category flags as one bit-packed '{PACKED_COLUMN}' column")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only classify rows appended since the last run (csv output; "
+                        "state is kept in <output>.state.json)")
+    parser.add_argument("--first-events", action="store_true",
+                        help="write each patient's first Reference Date per category (and MACE) "
+                        "instead of per-record flags")
+    parser.add_argument("--last", action="store_true",
+                        help="with --first-events, also write each patient's last date per category")
+    parser.add_argument("--count", action="store_true",
+                        help="with --first-events, also write the number of matching records")
+    parser.add_argument("--date-format", metavar="FORMAT",
+                        help="with --first-events, strptime format of Reference Date (e.g. %%d/%%m/%%Y) "
+                        "or ISO8601 (default: guessed from the first date)")
+    parser.add_argument("--report", action="store_true",
+                        help="time each stage and write a json run report to <output>.report.json "
+                        "(per-record output)")
+    parser.add_argument("--categories", metavar="FILE",
+                        help="json/yaml category definition file to use instead of the built-in categories")
+    parser.add_argument("--artifact-dir", default=None,
+                        help="where compiled category files are cached; must not be shared or writable "
+                        f"by other users (default: {default_artifact_dir()})")
+    parser.add_argument("--export-categories", metavar="FILE",
+                        help="write the built-in categories as a json definition file and exit")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+                        help=f"distinct codes kept in the lookup cache (default: {DEFAULT_CACHE_SIZE})")
+    parser.add_argument("--cache-stats", action="store_true",
+                        help="print lookup cache hit/miss/eviction counts when done")
+    args = parser.parse_args(argv)
+
+    if args.export_categories:
+        save_category_definitions(args.export_categories)
+        print(f"built-in categories written to {args.export_categories}")
+        return 0
+    if not args.inputs:
+        parser.error("at least one INPUT is required")
+    if args.incremental and (args.first_events or args.format not in (None, "csv")):
+        parser.error("--incremental only supports per-record csv output")
+
+    #expand globs ourselves, the shell doesn't on every platform
+    inputs = []
+    for pattern in args.inputs:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            parser.error(f"no files match '{pattern}'")
+        inputs.extend(matches)
+
+    #a directory output holds one file per input
+    output_dir = None
+    if (args.output and len(inputs) > 1 and not os.path.isdir(args.output)
+            and not args.output.endswith(("/", os.sep))
+            and (os.path.exists(args.output) or os.path.splitext(args.output)[1])):
+        parser.error(f"-o {args.output} looks like a file, but {len(inputs)} inputs were given; "
+                     "pass an output directory instead")
+    if args.output and (len(inputs) > 1 or os.path.isdir(args.output) or args.output.endswith(("/", os.sep))):
+        output_dir = args.output
+
+    #inputs with the same name in different directories would overwrite each other
+    save_paths, written_by = [], {}
+    for file_path in inputs:
+        if args.output and output_dir is None:
+            save_path = args.output
+        else:
+            suffix = "_first_dx" if args.first_events else "_dx"
+            save_path = default_output_path(file_path, output_dir, args.format or "csv", suffix)
+        key = os.path.normcase(os.path.abspath(save_path))
+        if key in written_by:
+            parser.error(f"{written_by[key]} and {file_path} would both be written to {save_path}; "
+                         "rename one of them or run them separately")
+        written_by[key] = file_path
+        save_paths.append(save_path)
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+
+    #one cache for the whole run, shared by every input file
+    index = CATEGORY_INDEX
+    if args.categories:
+        try:
+            index = compile_category_file(args.categories, args.artifact_dir)
+        except (OSError, ValueError) as e:
+            parser.error(f"could not load category definitions: {e}")
+    cache = CodeMaskCache(index, args.cache_size)
+    failed = 0
+    for save_path, file_path in zip(save_paths, inputs):
+        try:
+            if args.incremental:
+                n_rows, rebuilt = process_incremental(file_path, save_path, chunksize=args.chunksize or None,
+                                                      workers=args.workers or None, cache=cache,
+                                                      packed=args.packed, engine=args.engine)
+                print(f"{file_path}: {'full rebuild' if rebuilt else 'appended rows only'}")
+            elif args.first_events:
+                n_rows, skipped = process_first_events(file_path, save_path, chunksize=args.chunksize or None,
+                                                       cache=cache, last=args.last, count=args.count,
+                                                       fmt=args.format, compression=args.compression,
+                                                       engine=args.engine, date_format=args.date_format)
+                if skipped:
+                    print(f"warning: {file_path}: {skipped} matching rows without a Reference Key "
+                          "or a parseable Reference Date were skipped", file=sys.stderr)
+            else:
+                report = RunReport() if args.report else None
+                n_rows = process_file(file_path, save_path, chunksize=args.chunksize or None,
+                                      workers=args.workers or None, cache=cache, fmt=args.format,
+                                      packed=args.packed, compression=args.compression, report=report,
+                                      engine=args.engine)
+                if report is not None:
+                    print(report.summary())
+        except Exception as e:
+            print(f"error: {file_path}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        print(f"{file_path} -> {save_path} ({n_rows} rows)")
+    if args.cache_stats:
+        stats = cache.stats()
+        print(f"code cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+              f"{stats['size']}/{stats['maxsize']} entries, hit rate {stats['hit_rate']:.1%}")
+    return 1 if failed else 0
 
 #launch app
 if __name__ == "__main__":
-    root = Tk()
-    app = ICD9App(root)
-    root.mainloop()
+    sys.exit(main())
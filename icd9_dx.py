@@ -0,0 +1,1170 @@
+#Developed by ODAT project
+#please see https://odat.info
+#please see https://github.com/ODAT-Project
+#icd-9 category matching as a library: the compiled matcher, the built-in
+#categories, vectorized classification and the file level apis (reading dx
+#extracts, SparseDx, first_events), shared by icd9-dx-builder.py and
+#importable from other code. pandas and numpy are imported where they are used.
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import nullcontext
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Mapping
+
+if TYPE_CHECKING:
+    #annotations only, the runtime imports stay lazy
+    import numpy as np
+    import pandas as pd
+
+#function to check icd9 code matches
+def icd9_matches(code: str, code_list: list) -> bool:
+    """
+    check if a given code matches any code in code_list.
+    supports:
+      - exact matches (e.g., '410.01' == '410.01')
+      - partial decimal matches (e.g., '410' matches '410.01')
+      - numeric ranges (e.g., '430-438') if present in code_list
+    """
+    code = code.strip()
+    for c in code_list:
+        c = c.strip()
+        #if c is a range like '430-438'
+        if '-' in c:
+            try:
+                start_val = float(c.split('-')[0])
+                end_val = float(c.split('-')[1])
+                code_val = float(code)
+                if start_val <= code_val <= end_val:
+                    return True
+            except ValueError:
+                pass
+        else:
+            #exact or partial match
+            if code == c or code.startswith(c + "."):
+                return True
+    return False
+
+#compiled lookup structure for a set of categories
+class CategoryIndex:
+    """
+    compiled form of a {category: code_list} dict.
+    gives the same answers as icd9_matches, but a code is looked up once
+    for all categories instead of scanning every code list:
+      - exact and dotted-prefix codes live in a hash table
+      - ranges like '430-438' are cut into elementary segments at every
+        start and end value, each holding the OR of the ranges covering it,
+        so a numeric code is found with one bisect
+    matches are returned as a bitmask, bit i set for the i-th category.
+    groups maps composite group names (e.g. 'MACE') to their member
+    categories and is compiled to one bitmask per group.
+    the index is immutable once built: categories is a tuple, groups and
+    the code tables are read-only.
+    fingerprint is a sha256 of the definitions, in order.
+    """
+
+    def __init__(self, categories: dict, groups: dict = None):
+        set_ = object.__setattr__
+        set_(self, "categories", tuple(categories.keys()))
+        groups = groups or {}
+        definition = [list(categories.items()), list(groups.items())]
+        set_(self, "fingerprint", hashlib.sha256(json.dumps(definition).encode()).hexdigest())
+        group_masks = {}
+        for name, members in groups.items():
+            unknown = [m for m in members if m not in categories]
+            if unknown:
+                raise CategoryDefinitionError(f"group '{name}' refers to unknown categories: {unknown}")
+            if name in categories:
+                #groups become output columns next to the category columns
+                raise CategoryDefinitionError(f"group '{name}' has the same name as a category")
+            group_masks[name] = self.mask_of(members)
+        exact = {}
+        ranges = []
+        for bit, code_list in enumerate(categories.values()):
+            flag = 1 << bit
+            for c in code_list:
+                c = c.strip()
+                if '-' in c:
+                    #same parsing as icd9_matches, bad ranges never match
+                    try:
+                        start_val = float(c.split('-')[0])
+                        end_val = float(c.split('-')[1])
+                    except ValueError:
+                        continue
+                    if start_val <= end_val:
+                        ranges.append((start_val, end_val, flag))
+                else:
+                    exact[c] = exact.get(c, 0) | flag
+        #_bounds[i] is covered by _point_masks[i], the open interval just
+        #below it by _gap_masks[i]; _gap_masks[-1] is above the last bound
+        bounds = sorted({v for start_val, end_val, _ in ranges for v in (start_val, end_val)})
+        point_masks = [0] * len(bounds)
+        gap_masks = [0] * (len(bounds) + 1)
+        for start_val, end_val, flag in ranges:
+            first = bisect_left(bounds, start_val)
+            last = bisect_left(bounds, end_val)
+            for i in range(first, last + 1):
+                point_masks[i] |= flag
+            for i in range(first + 1, last + 1):
+                gap_masks[i] |= flag
+        #the tables are frozen, so a shared index can't be changed under a
+        #CodeMaskCache that already remembers its answers
+        set_(self, "groups", MappingProxyType(group_masks))
+        set_(self, "_exact", MappingProxyType(exact))
+        set_(self, "_bounds", tuple(bounds))
+        set_(self, "_point_masks", tuple(point_masks))
+        set_(self, "_gap_masks", tuple(gap_masks))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CategoryIndex is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("CategoryIndex is immutable")
+
+    def __getstate__(self):
+        #mappingproxy can't be pickled, store plain dicts
+        state = dict(self.__dict__)
+        state["groups"] = dict(self.groups)
+        state["_exact"] = dict(self._exact)
+        return state
+
+    def __setstate__(self, state):
+        state["groups"] = MappingProxyType(state["groups"])
+        state["_exact"] = MappingProxyType(state["_exact"])
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+    def lookup(self, code: str) -> int:
+        """return the bitmask of every category the code belongs to."""
+        code = code.strip()
+        exact = self._exact
+        mask = exact.get(code, 0)
+        #'410' matches '410.01', so try every prefix that ends before a '.'
+        dot = code.find('.')
+        while dot != -1:
+            mask |= exact.get(code[:dot], 0)
+            dot = code.find('.', dot + 1)
+        bounds = self._bounds
+        if bounds:
+            try:
+                code_val = float(code)
+            except ValueError:
+                return mask
+            i = bisect_left(bounds, code_val)
+            if i < len(bounds) and bounds[i] == code_val:
+                mask |= self._point_masks[i]
+            else:
+                mask |= self._gap_masks[i]
+        return mask
+
+    def matches(self, code: str) -> list:
+        """return the names of every category the code belongs to."""
+        mask = self.lookup(code)
+        return [cat for bit, cat in enumerate(self.categories) if mask >> bit & 1]
+
+    def mask_of(self, names: list) -> int:
+        """return the bitmask covering the given category names."""
+        return sum(1 << bit for bit, cat in enumerate(self.categories) if cat in names)
+
+    @property
+    def mace_mask(self) -> int:
+        """bitmask of the MACE group, 0 when it isn't defined."""
+        return self.groups.get("MACE", 0)
+
+class CategoryDefinitionError(ValueError):
+    """raised when category definitions are malformed."""
+
+#distinct codes remembered by default
+DEFAULT_CACHE_SIZE = 65_536
+
+#memoized code lookups in front of a CategoryIndex
+class CodeMaskCache:
+    """
+    bounded lru cache mapping a normalized (stripped) code to its category
+    bitmask. dx data repeats a few thousand codes endlessly, so most lookups
+    never reach the index. counts hits, misses and evictions so the size can
+    be tuned on real data. safe to share between threads.
+    """
+
+    def __init__(self, index: CategoryIndex, maxsize: int = DEFAULT_CACHE_SIZE):
+        self.index = index
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def categories(self) -> tuple:
+        return self.index.categories
+
+    @property
+    def groups(self) -> Mapping:
+        return self.index.groups
+
+    @property
+    def mace_mask(self) -> int:
+        return self.index.mace_mask
+
+    def lookup(self, code: str) -> int:
+        """return the category bitmask of code, from the cache when possible."""
+        code = code.strip()
+        with self._lock:
+            mask = self._masks.get(code)
+            if mask is not None:
+                self._masks.move_to_end(code)
+                self.hits += 1
+                return mask
+            self.misses += 1
+        mask = self.index.lookup(code)
+        if self.maxsize > 0:
+            with self._lock:
+                self._masks[code] = mask
+                if len(self._masks) > self.maxsize:
+                    self._masks.popitem(last=False)
+                    self.evictions += 1
+        return mask
+
+    def add_counts(self, hits: int, misses: int, evictions: int):
+        """fold in counters from another cache, e.g. one in a worker process."""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def stats(self) -> dict:
+        """return the counters plus current size and hit rate."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._masks),
+                "maxsize": self.maxsize,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        """drop all cached codes and reset the counters."""
+        with self._lock:
+            self._masks.clear()
+            self.hits = self.misses = self.evictions = 0
+
+#report arguments below take the builder's RunReport, or anything with a
+#stage(name) context manager and the same counters
+def _stage(report, name: str):
+    #time a stage when a report is being collected
+    return report.stage(name) if report is not None else nullcontext()
+
+
+#define all categories
+ALL_CATEGORIES = {
+    # ------------------------ MACE Categories (Existing) ------------------------
+    "Acute myocardial infarction": [
+        "410", "410.01", "410.02", "410.1", "410.11", "410.12", "410.2", "410.21", "410.22",
+        "410.3", "410.31", "410.32", "410.4", "410.41", "410.42", "410.5", "410.51", "410.52",
+        "410.6", "410.61", "410.62", "410.7", "410.71", "410.72", "410.8", "410.81", "410.82",
+        "410.9", "410.91", "410.92"
+    ],
+    "Heart failure": [
+        "428", "428.1", "428.2", "428.21", "428.22", "428.23",
+        "428.3", "428.31", "428.32", "428.33", "428.4", "428.41", "428.42",
+        "428.43", "428.9", "398.91", "402.01", "402.11", "402.91",
+        "404.01", "404.03", "404.11", "404.13", "404.91", "404.93"
+    ],
+    "Stroke/transient ischemic attack": [
+        "435", "435.1", "435.2", "435.3", "435.8", "435.9",
+        "433.81", "433.91", "434", "436", "437", "437.1",
+        "433.31", "433.01", "434.01", "434.1", "434.11", "434.9",
+        "434.91", "437.2", "437.3", "437.4", "437.5", "437.6",
+        "437.7", "437.8", "437.9", "430", "431", "432",
+        "432.1", "432.9"
+    ],
+
+    # ------------------------ Additional Categories (Existing) ------------------------
+    "Atrial fibrillation": ["427.31"],
+    "Atrial flutter": ["427.32"],
+    "Ventricular tachycardia": ["427.1"],
+    "Ventricular fibrillation": ["427.0"], # Note: ICD-9 427.0 is Cardiac arrest, 427.4 is Ventricular fibrillation
+    "Cerebral embolism": ["434.1"], # This is already in Stroke/TIA, "434.1" = Cerebral embolism
+    "Pulmonary embolism and infarction": ["415.1"], # Can be expanded: "415.11", "415.12", "415.13", "415.19"
+    "Chronic pulmonary embolism": ["416.2"],
+    "Phlebitis and thrombophlebitis of deep veins of lower extremities": ["451.1"], # Can be expanded: "451.11", "451.19"
+    "Phlebitis and thrombophlebitis of lower extremities, unspecified": ["451.2"],
+    "Phlebitis and thrombophlebitis of iliac vein": ["451.81"],
+    "Phlebitis and thrombophlebitis of deep veins of upper extremities": ["451.83"],
+    "Phlebitis and thrombophlebitis of other sites": ["451.89"],
+    "Phlebitis and thrombophlebitis of unspecified site": ["451.9"],
+    "Thrombophlebitis migrans": ["453.1"],
+    "Other venous embolism and thrombosis of inferior vena cava": ["453.2"],
+    "Acute venous embolism and thrombosis of deep vessels of lower extremity": ["453.4", "453.40", "453.41", "453.42"], # Expanded
+    "Chronic venous embolism and thrombosis of deep vessels of lower extremity": ["453.5", "453.50", "453.51", "453.52"], # Expanded
+    "Chronic venous embolism and thrombosis of other specified vessels": ["453.7"],
+    "Acute venous embolism and thrombosis of other specified veins": ["453.8"],
+    "Acute venous embolism and thrombosis of unspecified site": ["453.9"],
+    "Old myocardial infarction": ["412"],
+    "Occlusion and stenosis of basilar artery with cerebral infarction": ["433.01"],
+    "Occlusion and stenosis of carotid artery with cerebral infarction": ["433.11"],
+    "Occlusion and stenosis of vertebral artery with cerebral infarction": ["433.21"],
+    "Occlusion and stenosis of multiple and bilateral precerebral arteries with cerebral infarction": ["433.31"],
+    "Occlusion and stenosis of other specified precerebral artery with cerebral infarction": ["433.81"],
+    "Occlusion and stenosis of unspecified precerebral artery with cerebral infarction": ["433.91"],
+    "Cerebral thrombosis": ["434"], # Can be expanded: "434.0", "434.00", "434.01", "434.9", "434.90", "434.91"
+    "Acute but ill-defined cerebrovascular disease": ["436"],
+    "Cerebral atherosclerosis": ["437.0"],
+    "Other generalized ischemic cerebrovascular disease": ["437.1"],
+    "Cerebrovascular disease (430-438)": ["430-438"], # This is a range, specific codes are often more useful for analysis.
+    "Transient cerebral ischemia": ["435"], # Covered in Stroke/TIA
+    "Diabetes mellitus": ["250", "250.0", "250.00", "250.01", "250.02", "250.03", "250.1", "250.10", "250.11", "250.12", "250.13", "250.2", "250.3", "250.4", "250.5", "250.6", "250.7", "250.8", "250.9"], # Expanded
+    "Hyperlipidaemia": ["272.0", "272.1", "272.2", "272.3", "272.4"],
+    "Unspecified essential hypertension": ["401.9"], # Consider also "401.0" Malignant, "401.1" Benign
+    "Essential hypertension": ["401", "401.0", "401.1", "401.9"], # Added broader and specified
+    "Aortic aneurysm and dissection": ["441", "441.0", "441.00", "441.01", "441.02", "441.03", "441.1", "441.2", "441.3", "441.4", "441.5", "441.6", "441.7", "441.9"], # Expanded
+    "Peripheral vascular disease, unspecified": ["443.9"], # Consider specific PVDs like "440.2" Atherosclerosis of native arteries of the extremities
+    "Atherosclerosis of extremities": ["440.2", "440.20", "440.21", "440.22", "440.23", "440.24", "440.29"],
+    "Gangrene": ["785.4"],
+    "Blood vessel replaced by other means": ["V43.4"],
+    "Arterial embolism and thrombosis": ["444", "444.0", "444.1", "444.2", "444.21", "444.22", "444.8", "444.81", "444.89", "444.9"], # Expanded
+    "Atheroembolism": ["445", "445.0", "445.01", "445.02", "445.8", "445.81", "445.82", "445.89"], # Expanded
+    "Chronic kidney disease": ["585", "585.1", "585.2", "585.3", "585.4", "585.5", "585.6", "585.9"], # Expanded to stages
+    "Chronic glomerulonephritis": ["582", "582.0", "582.1", "582.2", "582.4", "582.8", "582.81", "582.89", "582.9"],
+    "Nephritis and nephropathy not specified as acute or chronic": ["583", "583.0", "583.1", "583.2", "583.4", "583.8", "583.81", "583.89", "583.9"],
+    "Renal failure, unspecified": ["586"],
+    "Disorders resulting from impaired renal function": ["588", "588.0", "588.1", "588.8", "588.81", "588.89", "588.9"],
+    "Tetralogy of Fallot": ["745.2"],
+    "The heart chambers including univentricular heart": ["745.3"],
+    "Truncus arteriosus": ["745.0"],
+    "Transposition": ["745.1"],
+    "Ventricular septal defect": ["745.4"],
+    "Atrial septal defect": ["745.5"],
+    "Atrioventricular septal defect": ["745.6", "745.8"],
+    "Pulmonary or tricuspid valve": ["746.0", "746.1"],
+    "Aortic or mitral valve": ["746.3", "746.4", "746.5", "746.6"],
+    "The aorta or pulmonary arteries or great arteries/veins": ["747"],
+    "Other cardiac malformation": ["746.9", "746.7", "746.8", "745.7", "745.9"],
+
+    # ------------------------ NEW Common Respiratory Conditions ------------------------
+    "Acute nasopharyngitis (Common Cold)": ["460"],
+    "Acute sinusitis": ["461", "461.0", "461.1", "461.2", "461.3", "461.8", "461.9"],
+    "Acute pharyngitis": ["462"],
+    "Acute tonsillitis": ["463"],
+    "Acute laryngitis and tracheitis (incl Croup, Epiglottitis)": [
+        "464", "464.0", "464.00", "464.01", "464.1", "464.10", "464.11", "464.2", "464.20", "464.21",
+        "464.3", "464.30", "464.31", "464.4", "464.5", "464.50", "464.51"
+    ],
+    "Acute upper respiratory infections, multiple/unspecified": ["465", "465.0", "465.8", "465.9"],
+    "Acute bronchitis and bronchiolitis": ["466", "466.0", "466.1", "466.11", "466.19"],
+    "Influenza": ["487", "487.0", "487.1", "487.8"], # Can be "488" for novel influenza
+    "Pneumonia, organism unspecified": ["486"],
+    "Other bacterial pneumonia": ["482", "482.0", "482.1", "482.2", "482.3", "482.4", "482.8", "482.9"],
+    "Viral pneumonia": ["480", "480.0", "480.1", "480.2", "480.3", "480.8", "480.9"],
+    "Chronic sinusitis": ["473", "473.0", "473.1", "473.2", "473.3", "473.8", "473.9"],
+    "Chronic bronchitis": ["491", "491.0", "491.1", "491.2", "491.20", "491.21", "491.8", "491.9"],
+    "Emphysema": ["492", "492.0", "492.8"],
+    "Asthma": [
+        "493", "493.0", "493.00", "493.01", "493.02", "493.1", "493.10", "493.11", "493.12",
+        "493.2", "493.20", "493.21", "493.22", "493.8", "493.81", "493.82", "493.9", "493.90",
+        "493.91", "493.92"
+    ],
+    "Chronic obstructive pulmonary disease (COPD)": ["496"], # NEC; often primary codes 491.x, 492.x are used
+
+    # ------------------------ NEW Common Infections (Non-Respiratory) ------------------------
+    "Intestinal infectious diseases": ["008.45", "008.8", "009.0", "009.1", "009.2", "009.3"], # 008.45 C.diff
+    "Septicemia": [
+        "038", "038.0", "038.1", "038.10", "038.11", "038.12", "038.19", "038.2", "038.3", "038.4",
+        "038.40", "038.41", "038.42", "038.43", "038.44", "038.49", "038.8", "038.9"
+    ],
+    "Human Immunodeficiency Virus (HIV) infection and AIDS": ["042", "V08"], # V08 Asymptomatic HIV
+    "Viral hepatitis": ["070", "070.0", "070.1", "070.2", "070.20", "070.21", "070.22", "070.23", "070.3", "070.30", "070.31", "070.32", "070.33", "070.4", "070.41", "070.44", "070.5", "070.51", "070.54", "070.70", "070.71", "070.9"],
+    "Urinary tract infection, site not specified": ["599.0"],
+    "Candidiasis (Thrush, Yeast Infection)": ["112", "112.0", "112.1", "112.2", "112.3", "112.4", "112.5", "112.8", "112.9"],
+    "Herpes zoster (Shingles)": ["053", "053.0", "053.1", "053.10", "053.11", "053.12", "053.13", "053.19", "053.2", "053.7", "053.8", "053.9"],
+    "Cellulitis and abscess": [
+        "681", "681.0", "681.00", "681.01", "681.02", "681.1", "681.10", "681.11", "681.9", # Finger and toe
+        "682", "682.0", "682.1", "682.2", "682.3", "682.4", "682.5", "682.6", "682.7", "682.8", "682.9" # Other sites
+    ],
+
+    # ------------------------ NEW Common Mental Health Disorders ------------------------
+    "Dementia (incl Alzheimer's)": ["290", "290.0", "290.1", "290.10", "290.11", "290.12", "290.13", "290.2", "290.20", "290.21", "290.3", "290.4", "290.40", "290.41", "290.42", "290.43", "331.0"], # 331.0 Alzheimer's
+    "Schizophrenia spectrum disorders": [
+        "295", "295.0", "295.00", "295.1", "295.10", "295.2", "295.20", "295.3", "295.30", "295.4", "295.40",
+        "295.6", "295.60", "295.7", "295.70", "295.8", "295.80", "295.9", "295.90"
+    ],
+    "Major Depressive Disorder": [
+        "296.2", "296.20", "296.21", "296.22", "296.23", "296.24", "296.25", "296.26",
+        "296.3", "296.30", "296.31", "296.32", "296.33", "296.34", "296.35", "296.36"
+    ],
+    "Bipolar Disorder": [
+        "296.0", "296.00", "296.01", "296.02", "296.03", "296.04", "296.05", "296.06",
+        "296.1", "296.10", "296.11", "296.12", "296.13", "296.14", "296.15", "296.16",
+        "296.4", "296.40", "296.41", "296.42", "296.43", "296.44", "296.45", "296.46",
+        "296.5", "296.50", "296.51", "296.52", "296.53", "296.54", "296.55", "296.56",
+        "296.6", "296.60", "296.61", "296.62", "296.63", "296.64", "296.65", "296.66",
+        "296.7", "296.8", "296.80", "296.81", "296.82", "296.89", "296.9", "296.90", "296.99"
+    ],
+    "Anxiety Disorders (Generalized, Panic, Phobias)": [
+        "300.0", "300.00", "300.01", "300.02", "300.09", # Anxiety states
+        "300.2", "300.20", "300.21", "300.22", "300.23", "300.29"  # Phobic disorders
+    ],
+    "Obsessive-compulsive disorder": ["300.3"],
+    "Post-traumatic stress disorder (PTSD)": ["309.81"],
+    "Adjustment disorders": ["309", "309.0", "309.1", "309.2", "309.24", "309.28", "309.3", "309.4", "309.8", "309.89", "309.9"],
+    "Attention deficit disorder (ADD/ADHD)": ["314", "314.0", "314.00", "314.01", "314.1", "314.2", "314.8", "314.9"],
+    "Substance use disorders (Alcohol, Opioids, etc.)": [ # General categories, can be much more specific
+        "303", "303.0", "303.00", "303.9", "303.90", # Alcohol dependence
+        "304", "304.0", "304.00", "304.1", "304.10", "304.2", "304.20", # Drug dependence (Opioid, Cocaine, etc.)
+        "305", "305.0", "305.00", "305.2", "305.20", "305.5", "305.50", "305.6", "305.60" # Non-dependent abuse
+    ],
+
+    # ------------------------ NEW Common Digestive System Disorders ------------------------
+    "Gastroesophageal reflux disease (GERD)": ["530.11", "530.81"], # 530.11 Reflux esophagitis, 530.81 GERD
+    "Gastritis and duodenitis": [
+        "535", "535.0", "535.00", "535.01", "535.1", "535.10", "535.11", "535.3", "535.30", "535.31",
+        "535.4", "535.40", "535.41", "535.5", "535.50", "535.51", "535.6", "535.60", "535.61", "535.7"
+    ],
+    "Peptic ulcer disease": ["531", "531.0", "531.1", "531.2", "531.3", "531.4", "531.5", "531.6", "531.7", "531.9", # Gastric
+                              "532", "532.0", "532.1", "532.2", "532.3", "532.4", "532.5", "532.6", "532.7", "532.9", # Duodenal
+                              "533", # Peptic, site unspecified
+                              "534"], # Gastrojejunal
+    "Irritable bowel syndrome (IBS)": ["564.1"],
+    "Diverticulosis and Diverticulitis of colon": [
+        "562.00", "562.01", "562.02", "562.03", # Diverticulosis of small intestine
+        "562.10", "562.11", "562.12", "562.13"  # Diverticulosis/itis of colon
+    ],
+    "Constipation": ["564.0", "564.00", "564.01", "564.02", "564.09"],
+    "Hemorrhoids": ["455", "455.0", "455.2", "455.3", "455.5", "455.6", "455.8"],
+    "Appendicitis": ["540", "540.0", "540.1", "540.9", "541", "542"],
+    "Cholelithiasis and Cholecystitis (Gallstones)": [
+        "574", "574.0", "574.00", "574.01", "574.1", "574.10", "574.11", "574.2", "574.20", "574.21", # Cholelithiasis
+        "575.0", "575.1", "575.10", "575.11", "575.12" # Cholecystitis
+    ],
+    "Non-infectious gastroenteritis and colitis": ["558.9"],
+    "Chronic liver disease and cirrhosis": ["571", "571.0", "571.1", "571.2", "571.3", "571.4", "571.40", "571.41", "571.49", "571.5", "571.6", "571.8", "571.9"],
+
+    # ------------------------ NEW Common Musculoskeletal Conditions ------------------------
+    "Rheumatoid arthritis": ["714", "714.0", "714.1", "714.2", "714.30", "714.31", "714.32", "714.33", "714.4", "714.8", "714.89", "714.9"],
+    "Osteoarthritis": [
+        "715", "715.0", "715.00", "715.04", "715.09", "715.1", "715.10", "715.11", "715.12", "715.13", "715.14", "715.15", "715.16", "715.17", "715.18",
+        "715.2", "715.3", "715.8", "715.9", "715.90", "715.91", "715.92", "715.93", "715.94", "715.95", "715.96", "715.97", "715.98"
+    ],
+    "Low back pain (Lumbago)": ["724.2"],
+    "Sciatica": ["724.3"],
+    "Intervertebral disc disorders (Herniated disc, Degeneration)": [
+        "722", "722.0", "722.1", "722.10", "722.11", "722.2", # Cervical, Thoracic, Lumbar
+        "722.3", "722.30", "722.31", "722.32", "722.39", # Schmorl's nodes
+        "722.4", "722.5", "722.51", "722.52", # Degeneration
+        "722.6", # Postlaminectomy syndrome
+        "722.7", "722.70", "722.71", "722.72", "722.73", # Disc disorder with myelopathy
+        "722.8", "722.80", "722.81", "722.82", "722.83", # Other specified
+        "722.9", "722.90", "722.91", "722.92", "722.93"  # Unspecified
+    ],
+    "Osteoporosis": ["733.0", "733.00", "733.01", "733.02", "733.03", "733.09"],
+    "Gout": ["274", "274.0", "274.00", "274.01", "274.02", "274.03", "274.1", "274.8", "274.9"], # This is metabolic
+    "Carpal tunnel syndrome": ["354.0"],
+
+    # ------------------------ NEW Common Cancers ------------------------
+    "Malignant neoplasm of bronchus and lung": ["162", "162.0", "162.2", "162.3", "162.4", "162.5", "162.8", "162.9"],
+    "Malignant neoplasm of female breast": ["174", "174.0", "174.1", "174.2", "174.3", "174.4", "174.5", "174.6", "174.8", "174.9"],
+    "Malignant neoplasm of male breast": ["175", "175.0", "175.9"],
+    "Malignant neoplasm of prostate": ["185"],
+    "Malignant neoplasm of colon": ["153", "153.0", "153.1", "153.2", "153.3", "153.4", "153.5", "153.6", "153.7", "153.8", "153.9"],
+    "Malignant neoplasm of rectum, rectosigmoid, and anus": ["154", "154.0", "154.1", "154.2", "154.3", "154.8"],
+    "Malignant melanoma of skin": ["172", "172.0", "172.1", "172.2", "172.3", "172.4", "172.5", "172.6", "172.7", "172.8", "172.9"],
+    "Other malignant neoplasm of skin (Non-melanoma)": ["173", "173.0", "173.1", "173.2", "173.3", "173.4", "173.5", "173.6", "173.7", "173.8", "173.9"],
+    "Malignant neoplasm of bladder": ["188", "188.0", "188.1", "188.2", "188.3", "188.4", "188.5", "188.6", "188.7", "188.8", "188.9"],
+    "Malignant neoplasm of kidney and other urinary organs": ["189", "189.0", "189.1", "189.2", "189.3", "189.4", "189.8", "189.9"],
+    "Malignant neoplasm of thyroid gland": ["193"],
+    "Malignant neoplasm of brain": ["191", "191.0", "191.1", "191.2", "191.3", "191.4", "191.5", "191.6", "191.7", "191.8", "191.9"],
+    "Non-Hodgkin's lymphomas": [
+        "200", "200.0", "200.00", "200.1", "200.10", "200.2", "200.20", "200.8", "200.80",
+        "202", "202.0", "202.00", "202.1", "202.10", "202.2", "202.20", "202.8", "202.80", "202.9", "202.90"
+    ],
+    "Hodgkin's disease": ["201", "201.0", "201.00", "201.1", "201.10", "201.2", "201.20", "201.4", "201.40", "201.5", "201.50", "201.6", "201.60", "201.7", "201.70", "201.9", "201.90"],
+    "Leukemias": [
+        "204", "204.0", "204.00", "204.1", "204.10", "204.8", "204.9", # Lymphoid
+        "205", "205.0", "205.00", "205.1", "205.10", "205.3", "205.8", "205.9", # Myeloid
+        "206", # Monocytic
+        "207", # Other specified
+        "208", "208.0", "208.00", "208.1", "208.10", "208.8", "208.9"  # Unspecified cell type
+    ],
+    "Multiple Myeloma": ["203", "203.0", "203.00", "203.01", "203.8", "203.80", "203.81"],
+    "Secondary malignant neoplasm (Metastasis)": [ # General categories
+        "196", # Lymph nodes
+        "197", # Respiratory and digestive
+        "198", # Other specified sites (bone, brain, liver etc)
+        "199"  # Unspecified site
+    ],
+
+    # ------------------------ NEW Other Common Conditions ------------------------
+    "Anemias (Iron deficiency, other unspecified)": [
+        "280", "280.0", "280.1", "280.8", "280.9", # Iron deficiency
+        "281", # Other deficiency anemias (B12, Folate)
+        "285.1", # Acute posthemorrhagic anemia
+        "285.2", # Anemia in chronic disease
+        "285.8", # Other specified anemias
+        "285.9"  # Anemia, unspecified
+    ],
+    "Thyroid disorders (Hypothyroidism, Hyperthyroidism)": [
+        "242", "242.0", "242.00", "242.01", "242.1", "242.2", "242.3", "242.4", "242.8", "242.9", "242.90", "242.91", # Thyrotoxicosis
+        "244", "244.0", "244.1", "244.2", "244.3", "244.8", "244.9"  # Acquired hypothyroidism
+    ],
+    "Migraine": ["346", "346.0", "346.00", "346.01", "346.1", "346.10", "346.11", "346.2", "346.20", "346.21", "346.8", "346.80", "346.81", "346.9", "346.90", "346.91"],
+    "Other headache syndromes": ["784.0", "307.81", "339.0", "339.1", "339.2", "339.3", "339.4", "339.8"], # 784.0 Headache, 307.81 Tension headache
+    "Allergic rhinitis": ["477", "477.0", "477.1", "477.2", "477.8", "477.9"],
+    "Obesity": ["278.00", "278.01", "278.03"], # 278.00 Obesity NOS, 278.01 Morbid obesity, 278.03 Overweight
+    "Sleep apnea": ["327.23", "780.51", "780.53", "780.57"], # 327.23 Obstructive sleep apnea, others are symptoms like hypersomnia with sleep apnea
+    "Vertigo and Dizziness": ["780.4", "386.0", "386.1", "386.10", "386.11", "386.12", "386.19", "386.2"], # 780.4 Dizziness, 386 Meniere's disease etc.
+    "Syncope and collapse": ["780.2"],
+    "Edema": ["782.3"], # Generalized edema
+    "Peripheral neuropathies": ["356.9", "357.9"], # Unspecified polyneuropathy, Unspecified inflammatory and toxic neuropathy
+    "Glaucoma": ["365", "365.0", "365.1", "365.10", "365.11", "365.12", "365.2", "365.9"],
+    "Cataract": ["366", "366.0", "366.1", "366.10", "366.15", "366.16", "366.17", "366.9"],
+    "Benign prostatic hyperplasia (BPH)": ["600", "600.0", "600.00", "600.01", "600.1", "600.2", "600.9"]
+}
+
+#MACE_CATEGORY_NAMES remains the same as per your definition
+MACE_CATEGORY_NAMES = [
+    "Acute myocardial infarction",
+    "Heart failure",
+    "Stroke/transient ischemic attack"
+]
+
+#compile categories once at startup
+CATEGORY_INDEX = CategoryIndex(ALL_CATEGORIES, {"MACE": MACE_CATEGORY_NAMES})
+MACE_MASK = CATEGORY_INDEX.mace_mask
+CODE_CACHE = CodeMaskCache(CATEGORY_INDEX)
+
+#bump when the pickled CategoryIndex layout changes, older artifacts are then ignored
+ARTIFACT_VERSION = 3
+
+#read external category definitions
+def load_category_definitions(path: str) -> tuple:
+    """
+    read category definitions from a json or yaml (needs pyyaml) file:
+        {"categories": {"Heart failure": ["428", "428.1", ...],
+                        "Cerebrovascular disease (430-438)": ["430-438"], ...},
+         "groups": {"MACE": ["Acute myocardial infarction", ...]}}
+    codes follow the same rules as ALL_CATEGORIES. every group gets a flag
+    column of its own (and a category in first_events), so 'MACE' is just
+    the group of the built-in set; without one there is no MACE column.
+    returns (categories, groups).
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    if path.lower().endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError("yaml category files require pyyaml (pip install pyyaml)") from e
+        try:
+            data = yaml.safe_load(raw)
+        except yaml.YAMLError as e:
+            raise CategoryDefinitionError(f"{path}: invalid yaml: {e}") from e
+    else:
+        data = json.loads(raw)
+
+    if not isinstance(data, dict) or not isinstance(data.get("categories"), dict):
+        raise CategoryDefinitionError(f"{path}: expected a 'categories' mapping")
+    categories = {}
+    for name, code_list in data["categories"].items():
+        if not isinstance(code_list, list) or not all(isinstance(c, str) for c in code_list):
+            raise CategoryDefinitionError(f"{path}: category '{name}' must be a list of code strings")
+        categories[str(name)] = code_list
+    groups = data.get("groups") or {}
+    if not isinstance(groups, dict) or not all(
+        isinstance(members, list) and all(isinstance(m, str) for m in members) for members in groups.values()
+    ):
+        raise CategoryDefinitionError(f"{path}: 'groups' must map group names to lists of category names")
+    return categories, {str(name): members for name, members in groups.items()}
+
+def save_category_definitions(path: str, categories: dict = None, groups: dict = None):
+    """write definitions (the built-in ones by default) as a json definition file."""
+    if categories is None:
+        categories = ALL_CATEGORIES
+        groups = {"MACE": MACE_CATEGORY_NAMES}
+    with open(path, "w") as f:
+        json.dump({"categories": categories, "groups": groups or {}}, f, indent=2)
+
+def default_artifact_dir() -> str:
+    """where compiled category artifacts are cached."""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "icd9-dx-builder")
+
+def _trusted_artifact(path: str) -> bool:
+    #only unpickle artifacts written by this user that nobody else can rewrite
+    if not hasattr(os, "getuid"):
+        return True
+    st = os.stat(path)
+    return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+#compile a definition file, reusing the cached artifact when possible
+def compile_category_file(path: str, artifact_dir: str = None) -> CategoryIndex:
+    """
+    return the CategoryIndex for a definition file. the compiled index is
+    pickled to artifact_dir under a name keyed by ARTIFACT_VERSION and the
+    sha256 of the file's content, so later runs with the same definitions
+    load it instead of parsing and compiling again. unreadable artifacts
+    are rebuilt.
+    artifacts are pickles, and loading a pickle can run arbitrary code, so
+    artifact_dir must be private to the user: it is created with mode 0700,
+    and on posix an artifact is only loaded when this user owns it and
+    nobody else can write to it (otherwise it is rebuilt).
+    """
+    import pickle
+
+    if artifact_dir is None:
+        artifact_dir = default_artifact_dir()
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    artifact = os.path.join(artifact_dir, f"categories-v{ARTIFACT_VERSION}-{digest}.pickle")
+    if os.path.exists(artifact) and _trusted_artifact(artifact):
+        try:
+            with open(artifact, "rb") as f:
+                return pickle.load(f)
+        except Exception:
+            pass
+
+    index = CategoryIndex(*load_category_definitions(path))
+    os.makedirs(artifact_dir, mode=0o700, exist_ok=True)
+    #write then rename, so a concurrent run never sees half an artifact
+    tmp = f"{artifact}.{os.getpid()}.tmp"
+    with os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, artifact)
+    return index
+
+#separators between codes in the diagnosis column
+CODE_SEPARATOR = r"[^\w\.]"
+
+#classify the distinct cells of a diagnosis code column
+def _classify_cells(dx_codes: pd.Series, matcher: CodeMaskCache, report=None) -> tuple:
+    #returns (cell id per row, packed category bits per distinct cell)
+    import numpy as np
+    import pandas as pd
+
+    n_bytes = (len(matcher.categories) + 7) // 8
+
+    with _stage(report, "tokenize"):
+        #factorize cells, str() them the same way a single row would be
+        cell_ids, cells = pd.factorize(dx_codes, use_na_sentinel=False)
+        cells = pd.Series([str(c) for c in cells], dtype=object)
+
+        #split into one code per row, keeping the cell position as index
+        tokens = cells.str.split(CODE_SEPARATOR, regex=True).explode()
+        tokens = tokens[tokens != ""]
+        token_ids, codes = pd.factorize(tokens.to_numpy())
+    if report is not None:
+        report.codes.update(codes)
+
+    with _stage(report, "match"):
+        #look up each distinct code once, as packed little-endian bytes
+        packed = b"".join(matcher.lookup(code).to_bytes(n_bytes, "little") for code in codes)
+        code_bits = np.frombuffer(packed, dtype=np.uint8).reshape(len(codes), n_bytes)
+
+        #or the code bitmasks together per cell (tokens are grouped by cell)
+        cell_bits = np.zeros((len(cells), n_bytes), dtype=np.uint8)
+        if len(tokens):
+            positions = tokens.index.to_numpy()
+            starts = np.flatnonzero(np.r_[True, positions[1:] != positions[:-1]])
+            cell_bits[positions[starts]] = np.bitwise_or.reduceat(code_bits[token_ids], starts, axis=0)
+
+    return cell_ids, cell_bits
+
+#vectorized classification of a diagnosis code column, bit-packed
+def classify_bits(dx_codes: pd.Series, matcher: CodeMaskCache = None, report=None) -> np.ndarray:
+    """
+    return the category bits of every entry of dx_codes, packed into a
+    uint8 array of shape (rows, ceil(categories / 8)); bit i of a row
+    (little-endian) is set when it matches the i-th category.
+    same result as checking every row on its own:
+      - identical cells are factorized and classified once
+      - cells are split into codes in bulk and exploded
+      - each distinct code is looked up once in the matcher
+      - code bitmasks are or-ed back per cell, then per row
+    matcher is a CodeMaskCache or a bare CategoryIndex, CODE_CACHE by default.
+    report, when given, collects stage timings, distinct codes and hits.
+    """
+    if matcher is None:
+        matcher = CODE_CACHE
+    cell_ids, cell_bits = _classify_cells(dx_codes, matcher, report)
+    #scatter cells back to rows
+    with _stage(report, "match"):
+        row_bits = cell_bits[cell_ids]
+    if report is not None:
+        report.count_hits(row_bits, len(matcher.categories))
+    return row_bits
+
+def _group_masks(matcher: CodeMaskCache, mace_mask: int = None) -> dict:
+    #{group: mask} of the flag columns, an explicit mace_mask overrides 'MACE'
+    groups = dict(matcher.groups)
+    if mace_mask is not None:
+        groups["MACE"] = mace_mask
+    return groups
+
+def _any_bits(row_bits: np.ndarray, mask: int) -> np.ndarray:
+    #0/1 per row, whether any bit of mask is set
+    import numpy as np
+
+    mask_bits = np.frombuffer(mask.to_bytes(row_bits.shape[1], "little"), dtype=np.uint8)
+    return (row_bits & mask_bits).any(axis=1).astype(np.uint8)
+
+#vectorized classification of a diagnosis code column
+def classify_codes(dx_codes: pd.Series, matcher: CodeMaskCache = None, mace_mask: int = None,
+                   report=None) -> pd.DataFrame:
+    """
+    return a 0/1 uint8 frame with one column per category plus one per
+    group ('MACE' for the built-in set), aligned to dx_codes. see
+    classify_bits for how rows are matched.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if matcher is None:
+        matcher = CODE_CACHE
+    row_bits = classify_bits(dx_codes, matcher, report)
+    with _stage(report, "match"):
+        flags = np.unpackbits(row_bits, axis=1, count=len(matcher.categories), bitorder="little")
+        result = pd.DataFrame(flags, index=dx_codes.index, columns=matcher.categories)
+        for name, mask in _group_masks(matcher, mace_mask).items():
+            result[name] = _any_bits(row_bits, mask)
+    if report is not None and "MACE" in result:
+        report.mace_hits += int(result["MACE"].sum())
+    return result
+
+#sparse classification of a diagnosis code column
+def classify_sparse(dx_codes: pd.Series, matcher: CodeMaskCache = None, mace_mask: int = None) -> tuple:
+    """
+    return (matrix, mace) for dx_codes: a scipy csr matrix of shape
+    (rows, categories) with a 1 for every category a row matches, and a
+    uint8 MACE vector. the matrix is built from the per-cell category lists
+    without materializing a dense row x category table. needs scipy.
+    """
+    import numpy as np
+    try:
+        from scipy import sparse
+    except ImportError as e:
+        raise ImportError("sparse output requires scipy (pip install scipy)") from e
+
+    if matcher is None:
+        matcher = CODE_CACHE
+    if mace_mask is None:
+        mace_mask = matcher.mace_mask
+    n_cats = len(matcher.categories)
+    cell_ids, cell_bits = _classify_cells(dx_codes, matcher)
+    indptr, indices = _row_indices(cell_ids, cell_bits, n_cats)
+    data = np.ones(len(indices), dtype=np.uint8)
+    matrix = sparse.csr_matrix((data, indices, indptr), shape=(len(cell_ids), n_cats))
+    return matrix, _any_bits(cell_bits, mace_mask)[cell_ids]
+
+def _row_indices(cell_ids: np.ndarray, cell_bits: np.ndarray, n_cats: int) -> tuple:
+    #csr (indptr, indices) of the categories of every row
+    import numpy as np
+
+    #category lists per distinct cell, as csr arrays
+    cell_rows, cell_cats = np.nonzero(np.unpackbits(cell_bits, axis=1, count=n_cats, bitorder="little"))
+    cell_nnz = np.bincount(cell_rows, minlength=len(cell_bits))
+    cell_ptr = np.r_[0, np.cumsum(cell_nnz)]
+
+    #repeat each row's cell list: indices are gathered, never expanded densely
+    row_nnz = cell_nnz[cell_ids]
+    indptr = np.r_[0, np.cumsum(row_nnz)]
+    offsets = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - cell_ptr[cell_ids], row_nnz)
+    return indptr, cell_cats[offsets].astype(np.int32)
+
+def _as_series(values) -> pd.Series:
+    #wrap a list or array of cells without copying a series
+    import pandas as pd
+
+    if isinstance(values, pd.Series):
+        return values
+    if isinstance(values, str):
+        raise TypeError("expected an iterable of codes or cells, not a single string")
+    if not hasattr(values, "__len__"):
+        values = list(values)
+    return pd.Series(values, dtype=object)
+
+#compiled matcher for embedding in other code
+class Matcher:
+    """
+    immutable batch classifier over a compiled CategoryIndex, safe to share
+    between threads: the index and its tables are frozen after compiling
+    and code lookups go through a locked CodeMaskCache. build one per set of
+    definitions and reuse it.
+    batch methods take a list, array or pandas series of raw diagnosis
+    cells (codes separated as in classify_bits); a single code is simply a
+    one-code cell. results line up with the input, series keep their index.
+    """
+
+    __slots__ = ("index", "cache")
+
+    def __init__(self, index: CategoryIndex = None, cache_size: int = DEFAULT_CACHE_SIZE):
+        if index is None:
+            index = CATEGORY_INDEX
+        object.__setattr__(self, "index", index)
+        object.__setattr__(self, "cache", CodeMaskCache(index, cache_size))
+
+    @classmethod
+    def from_definitions(cls, categories: dict, groups: dict = None,
+                         cache_size: int = DEFAULT_CACHE_SIZE) -> Matcher:
+        """compile a {category: code_list} dict and optional groups."""
+        return cls(CategoryIndex(categories, groups), cache_size)
+
+    @classmethod
+    def from_file(cls, path: str, artifact_dir: str = None, cache_size: int = DEFAULT_CACHE_SIZE) -> Matcher:
+        """load a json/yaml definition file, see compile_category_file."""
+        return cls(compile_category_file(path, artifact_dir), cache_size)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Matcher is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Matcher is immutable")
+
+    def __reduce__(self):
+        #the cache and its lock are rebuilt, not pickled
+        return type(self), (self.index, self.cache.maxsize)
+
+    @property
+    def categories(self) -> tuple:
+        return self.index.categories
+
+    @property
+    def mace_mask(self) -> int:
+        return self.index.mace_mask
+
+    def group_mask(self, name: str) -> int:
+        """bitmask of a compiled group, e.g. 'MACE'."""
+        return self.index.groups[name]
+
+    def lookup(self, code: str) -> int:
+        """category bitmask of a single code."""
+        return self.cache.lookup(code)
+
+    def matches(self, code: str) -> list:
+        """names of the categories a single code matches."""
+        mask = self.lookup(code)
+        return [cat for i, cat in enumerate(self.index.categories) if mask >> i & 1]
+
+    def classify_bits(self, values) -> np.ndarray:
+        """packed category bits per value, see classify_bits."""
+        return classify_bits(_as_series(values), self.cache)
+
+    def classify_indices(self, values) -> tuple:
+        """
+        category indices per value in csr form, (indptr, indices): the
+        categories of value i are indices[indptr[i]:indptr[i + 1]], in
+        category order.
+        """
+        cell_ids, cell_bits = _classify_cells(_as_series(values), self.cache)
+        return _row_indices(cell_ids, cell_bits, len(self.index.categories))
+
+    def classify_codes(self, values) -> pd.DataFrame:
+        """0/1 frame with one column per category and group, see classify_codes."""
+        return classify_codes(_as_series(values), self.cache)
+
+    def classify_frame(self, df: pd.DataFrame, column: str = "All Diagnosis Code (ICD9)") -> pd.DataFrame:
+        """df with the category and group flags of its column appended."""
+        import pandas as pd
+
+        return pd.concat([df, self.classify_codes(df[column])], axis=1)
+
+#input columns the builder needs
+REQUIRED_COLS = ["Reference Key", "All Diagnosis Code (ICD9)", "Reference Date"]
+
+#rows per chunk when streaming large files
+DEFAULT_CHUNK_SIZE = 100_000
+
+class MissingColumnError(ValueError):
+    """raised when the input lacks one of REQUIRED_COLS."""
+
+#spreadsheet inputs, read with openpyxl instead of the csv parser
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+
+#csv parsers: pandas' own c parser, or pyarrow's multithreaded one
+READ_ENGINES = ("c", "pyarrow")
+
+#cells pandas' read_csv treats as missing by default; the pyarrow and xlsx
+#readers use the same list so every engine blanks the same cells
+NA_VALUES = (
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan", "1.#IND", "1.#QNAN",
+    "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null",
+)
+
+def _check_columns(columns):
+    for rc in REQUIRED_COLS:
+        if rc not in columns:
+            raise MissingColumnError(f"the column '{rc}' is required but not found.")
+
+#read the required columns of file_path, optionally in chunks
+def _read_chunks(file_path: str, chunksize: int = None, engine: str = "c"):
+    """
+    return an iterable of frames holding only REQUIRED_COLS of file_path,
+    chunksize rows each (one frame for the whole file without chunksize).
+    the header is checked before any data is read. csv files go through
+    the pandas c parser, or pyarrow with engine='pyarrow'; .xlsx files are
+    streamed row by row. every column is read as text, so nothing depends
+    on per-chunk type guessing or on where the chunk boundaries fall.
+    """
+    import pandas as pd
+
+    if engine not in READ_ENGINES:
+        raise ValueError(f"unknown engine '{engine}', expected one of {', '.join(READ_ENGINES)}")
+    if file_path.lower().endswith(EXCEL_EXTENSIONS):
+        return _read_excel_chunks(file_path, chunksize)
+
+    #check required cols before reading any data
+    _check_columns(pd.read_csv(file_path, nrows=0).columns)
+    if engine == "pyarrow":
+        return _read_arrow_chunks(file_path, chunksize)
+
+    #chunk-level dtype guessing would turn '430e0' into 430.0, or every key of
+    #a chunk with one blank key into a float
+    dtype = {rc: str for rc in REQUIRED_COLS}
+    if chunksize:
+        return pd.read_csv(file_path, usecols=REQUIRED_COLS, dtype=dtype, chunksize=chunksize)
+    return [pd.read_csv(file_path, usecols=REQUIRED_COLS, dtype=dtype)]
+
+def _read_arrow_chunks(source, chunksize: int = None, column_names: list = None):
+    """
+    pyarrow reads key and date as text with the same missing-value
+    markers (NA_VALUES) as the c parser, and dictionary-encodes the
+    codes, so every distinct cell is stored and classified once. the
+    parser works in byte blocks, which are re-cut into chunksize rows.
+    source is a path or an open binary file; with column_names the
+    source has no header row.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    convert = csv.ConvertOptions(
+        include_columns=REQUIRED_COLS,
+        column_types={
+            "Reference Key": pa.string(),
+            "All Diagnosis Code (ICD9)": pa.dictionary(pa.int32(), pa.string()),
+            "Reference Date": pa.string(),
+        },
+        null_values=list(NA_VALUES),
+        strings_can_be_null=True,
+    )
+    read = csv.ReadOptions(column_names=column_names)
+    if not chunksize:
+        return [csv.read_csv(source, read_options=read, convert_options=convert).to_pandas()]
+
+    def chunks():
+        pending, n_pending, n_chunks = [], 0, 0
+        with csv.open_csv(source, read_options=read, convert_options=convert) as reader:
+            for batch in reader:
+                pending.append(batch)
+                n_pending += batch.num_rows
+                while n_pending >= chunksize:
+                    table = pa.Table.from_batches(pending, reader.schema)
+                    yield table.slice(0, chunksize).to_pandas()
+                    n_chunks += 1
+                    rest = table.slice(chunksize)
+                    pending, n_pending = rest.to_batches(), rest.num_rows
+            if n_pending or not n_chunks:
+                yield pa.Table.from_batches(pending, reader.schema).to_pandas()
+
+    return chunks()
+
+def _read_excel_chunks(file_path: str, chunksize: int = None):
+    """
+    stream the first sheet of a workbook in read-only mode, so only the
+    current chunk of rows is held in memory. cells are turned into text
+    (dates at midnight as plain dates) and NA_VALUES become missing; fully
+    blank rows are skipped.
+    """
+    import datetime
+    import pandas as pd
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    rows = wb.worksheets[0].iter_rows(values_only=True)
+    header = [str(c) if c is not None else "" for c in next(rows, ())]
+    try:
+        _check_columns(header)
+    except MissingColumnError:
+        wb.close()
+        raise
+    positions = [header.index(rc) for rc in REQUIRED_COLS]
+
+    def text(v):
+        if v is None:
+            return None
+        if isinstance(v, datetime.datetime) and v.time() == datetime.time():
+            v = v.date()
+        v = str(v)
+        return None if v in NA_VALUES else v
+
+    def frame(values):
+        return pd.DataFrame([[text(v) for v in row] for row in values], columns=REQUIRED_COLS, dtype=object)
+
+    def chunks():
+        block, n_chunks = [], 0
+        try:
+            for row in rows:
+                values = tuple(row[i] if i < len(row) else None for i in positions)
+                if all(v is None for v in values):
+                    continue
+                block.append(values)
+                if chunksize and len(block) == chunksize:
+                    yield frame(block)
+                    block, n_chunks = [], n_chunks + 1
+            if block or not n_chunks:
+                yield frame(block)
+        finally:
+            wb.close()
+
+    return chunks() if chunksize else list(chunks())
+
+#sparse classification of a whole file
+class SparseDx:
+    """
+    classification of a file as sparse data for modelling:
+      - matrix: csr matrix, one row per input row, one column per category
+      - mace: uint8 MACE flag per row
+      - rows: 'Reference Key' and 'Reference Date' of each matrix row
+      - categories: category name of each matrix column
+    """
+
+    def __init__(self, matrix, mace, rows, categories):
+        self.matrix = matrix
+        self.mace = mace
+        self.rows = rows
+        self.categories = categories
+
+    @classmethod
+    def from_file(cls, file_path: str, chunksize: int = DEFAULT_CHUNK_SIZE, cache: CodeMaskCache = None,
+                  engine: str = "c") -> SparseDx:
+        """classify file_path chunk by chunk, never building the dense frame."""
+        import numpy as np
+        import pandas as pd
+
+        if cache is None:
+            cache = CODE_CACHE
+        matrices, maces, rows = [], [], []
+        for chunk in _read_chunks(file_path, chunksize, engine=engine):
+            matrix, mace = classify_sparse(chunk["All Diagnosis Code (ICD9)"], cache)
+            matrices.append(matrix)
+            maces.append(mace)
+            rows.append(chunk[["Reference Key", "Reference Date"]])
+        #scipy is known to be importable once classify_sparse has run
+        from scipy import sparse
+
+        return cls(
+            sparse.vstack(matrices, format="csr"),
+            np.concatenate(maces),
+            pd.concat(rows, ignore_index=True),
+            list(cache.categories),
+        )
+
+#fold (key, category) event rows into one row per pair
+def _reduce_events(events: pd.DataFrame) -> pd.DataFrame:
+    grouped = events.groupby(["Reference Key", "Category"], sort=False)
+    return grouped.agg(**{
+        "First Date": ("First Date", "min"),
+        "Last Date": ("Last Date", "max"),
+        "Count": ("Count", "sum"),
+    }).reset_index()
+
+#date format of the first non-blank value of dates, None when there is none
+def _guess_date_format(dates: pd.Series) -> str:
+    import warnings
+    from pandas.tseries.api import guess_datetime_format
+
+    values = dates.dropna().astype(str).str.strip()
+    values = values[values != ""]
+    if values.empty:
+        return None
+    with warnings.catch_warnings():
+        #the dayfirst hint is noise here, the guess is reported back to the caller
+        warnings.simplefilter("ignore")
+        return guess_datetime_format(values.iloc[0]) or "ISO8601"
+
+#patient level first-event aggregation
+def first_events(file_path: str, chunksize: int = DEFAULT_CHUNK_SIZE, cache: CodeMaskCache = None,
+                 last: bool = False, count: bool = False, engine: str = "c",
+                 date_format: str = None) -> pd.DataFrame:
+    """
+    return each patient's first 'Reference Date' for every category they
+    have, with each group (MACE) as a category of its own: one row per
+    (Reference Key, Category), optionally with the last date and the number
+    of matching records.
+    each chunk's sparse (row, category) pairs are reduced per patient and
+    category as the file streams, so memory follows the number of distinct
+    pairs and the dense wide table is never built. patients come out in
+    order of first appearance, categories in output column order (groups
+    first).
+    every date is parsed with one format for the whole run: date_format
+    (a strptime format or 'ISO8601'), or by default the format guessed
+    from the first non-blank date, which reads ambiguous dates like
+    01/03/2020 month first. matching rows with a blank Reference Key (no
+    patient to attribute them to), or whose date is blank or doesn't fit
+    the format, are skipped; their number is returned in
+    result.attrs['skipped_rows'] and the format used in
+    result.attrs['date_format'].
+    """
+    import numpy as np
+    import pandas as pd
+
+    if cache is None:
+        cache = CODE_CACHE
+    groups = _group_masks(cache)
+    names = list(groups) + list(cache.categories)
+
+    parts = []
+    pending = compacted = skipped = 0
+    for chunk in _read_chunks(file_path, chunksize, engine):
+        cell_ids, cell_bits = _classify_cells(chunk["All Diagnosis Code (ICD9)"], cache)
+        indptr, indices = _row_indices(cell_ids, cell_bits, len(cache.categories))
+        #one (row, category) pair per event, groups are the first categories
+        group_rows = [np.flatnonzero(_any_bits(cell_bits, mask)[cell_ids]) for mask in groups.values()]
+        rows = np.concatenate(group_rows + [np.repeat(np.arange(len(chunk)), np.diff(indptr))])
+        cats = np.concatenate([np.full(len(r), g, dtype=np.int32) for g, r in enumerate(group_rows)]
+                              + [indices.astype(np.int32) + len(groups)])
+        in_row_order = np.argsort(rows, kind="stable")
+        rows, cats = rows[in_row_order], cats[in_row_order]
+        #parse each row's date once with the run's format, then pick per event
+        if date_format is None:
+            date_format = _guess_date_format(chunk["Reference Date"])
+        dates = pd.to_datetime(chunk["Reference Date"], format=date_format or "ISO8601",
+                               errors="coerce").to_numpy()[rows]
+        keys = chunk["Reference Key"].to_numpy()[rows]
+        #an event needs a patient and a date, rows missing either are skipped
+        unusable = np.isnat(dates) | pd.isna(keys)
+        skipped += len(np.unique(rows[unusable]))
+        events = pd.DataFrame({
+            "Reference Key": keys,
+            "Category": cats,
+            "First Date": dates,
+            "Last Date": dates,
+            "Count": np.ones(len(rows), dtype=np.int64),
+        })
+        parts.append(_reduce_events(events[~unusable]))
+        pending += len(parts[-1])
+        #compact once the new partials outgrow the compacted ones (amortized linear)
+        if len(parts) > 1 and pending >= compacted:
+            parts = [_reduce_events(pd.concat(parts, ignore_index=True))]
+            compacted = len(parts[0])
+            pending = 0
+
+    result = _reduce_events(pd.concat(parts, ignore_index=True)) if len(parts) > 1 else parts[0]
+    #patients by first appearance, then categories in column order
+    order = np.lexsort((result["Category"].to_numpy(), pd.factorize(result["Reference Key"])[0]))
+    result = result.iloc[order].reset_index(drop=True)
+    result["Category"] = pd.Categorical.from_codes(result["Category"], categories=names)
+    cols = ["Reference Key", "Category", "First Date"]
+    if last:
+        cols.append("Last Date")
+    if count:
+        cols.append("Count")
+    result = result[cols]
+    result.attrs["skipped_rows"] = skipped
+    result.attrs["date_format"] = date_format
+    return result
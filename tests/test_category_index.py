@@ -0,0 +1,122 @@
+#Developed by ODAT project
+#please see https://odat.info
+#please see https://github.com/ODAT-Project
+"""
+regression tests: the compiled CategoryIndex must give exactly the
+answers of the original icd9_matches rules.
+"""
+import math
+import os
+import pickle
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from icd9_dx import ALL_CATEGORIES, CategoryDefinitionError, CategoryIndex, CodeMaskCache, icd9_matches
+
+#codes that aren't well-formed icd-9, or that only look numeric to float()
+MALFORMED = [
+    "", " ", "abc", "nan", "NaN", "inf", "-inf", "430e0", "4.3e2", "1e3", "-430", "+430",
+    "410.", ".410", "410..01", "410.01.", "4 10", "0x1A", "V", "E", "v45.81", "e800",
+    "430-438", "_430", "٤٣٠",
+]
+
+def _expected_mask(code: str, categories: dict) -> int:
+    #the original rule: bit i set when icd9_matches(code, i-th code list)
+    return sum(1 << i for i, code_list in enumerate(categories.values()) if icd9_matches(code, code_list))
+
+def _probe_codes(categories: dict) -> list:
+    #listed codes, dotted and undotted extensions, truncations and range edges
+    codes = set(MALFORMED)
+    for code_list in categories.values():
+        for c in code_list:
+            c = c.strip()
+            if "-" in c:
+                start, end = c.split("-")[:2]
+                for value in (start, end):
+                    codes.update([value, value + ".0", value + ".9", value + ".99", value + "0"])
+                    try:
+                        v = float(value)
+                    except ValueError:
+                        continue
+                    if not math.isfinite(v):
+                        continue
+                    codes.update([repr(v - 0.01), repr(v + 0.01), repr(v - 1), repr(v + 1), str(int(v))])
+                continue
+            codes.update([c, c + ".0", c + ".1", c + ".99", c + "0", c + "9", c[:-1], " " + c + " "])
+            if "." in c:
+                head, tail = c.split(".", 1)
+                codes.update([head, head + ".", head + "." + tail[:-1], head + tail])
+    return sorted(codes)
+
+class CategoryIndexMatchesTest(unittest.TestCase):
+    def assert_same_as_icd9_matches(self, categories: dict):
+        index = CategoryIndex(categories)
+        for code in _probe_codes(categories):
+            with self.subTest(code=code):
+                self.assertEqual(index.lookup(code), _expected_mask(code, categories))
+
+    def test_builtin_categories(self):
+        self.assert_same_as_icd9_matches(ALL_CATEGORIES)
+
+    def test_overlapping_and_decimal_ranges(self):
+        self.assert_same_as_icd9_matches({
+            "a": ["430-438"],
+            "b": ["435.5-440", "250"],
+            "c": ["250.1", " 401 ", "V45.81"],
+            "d": ["E800-E807", "800-804.9"],
+            "e": ["436-436"],
+        })
+
+    def test_touching_nested_and_unbounded_ranges(self):
+        self.assert_same_as_icd9_matches({
+            "a": ["400-410", "420-430"],
+            "b": ["410-420", "405-405"],
+            "c": ["401-429", "bad-range", "440-430"],
+            "d": ["500-inf", "-inf-0"],
+        })
+
+    def test_matches_lists_category_names(self):
+        index = CategoryIndex(ALL_CATEGORIES)
+        for code in ["410.01", "428", "430", "V45.81", "abc"]:
+            with self.subTest(code=code):
+                expected = [cat for cat, code_list in ALL_CATEGORIES.items() if icd9_matches(code, code_list)]
+                self.assertEqual(index.matches(code), expected)
+
+    def test_group_named_like_a_category_is_rejected(self):
+        name = next(iter(ALL_CATEGORIES))
+        with self.assertRaises(CategoryDefinitionError):
+            CategoryIndex(ALL_CATEGORIES, {name: [name]})
+
+    def test_cache_gives_index_answers(self):
+        index = CategoryIndex(ALL_CATEGORIES)
+        cache = CodeMaskCache(index, maxsize=8)
+        codes = _probe_codes(ALL_CATEGORIES)
+        for code in codes + codes:
+            self.assertEqual(cache.lookup(code), index.lookup(code.strip()))
+
+class CategoryIndexFrozenTest(unittest.TestCase):
+    def test_tables_cannot_be_changed(self):
+        index = CategoryIndex(ALL_CATEGORIES, {"MACE": list(ALL_CATEGORIES)[:2]})
+        with self.assertRaises(AttributeError):
+            index.categories = ()
+        with self.assertRaises(TypeError):
+            index.groups["MACE"] = 0
+        with self.assertRaises(TypeError):
+            index._exact["410"] = 0
+        with self.assertRaises(AttributeError):
+            index.categories.append("x")
+
+    def test_pickle_keeps_answers_and_stays_frozen(self):
+        index = CategoryIndex(ALL_CATEGORIES, {"MACE": list(ALL_CATEGORIES)[:2]})
+        copy = pickle.loads(pickle.dumps(index))
+        self.assertEqual(copy.fingerprint, index.fingerprint)
+        self.assertEqual(dict(copy.groups), dict(index.groups))
+        for code in _probe_codes(ALL_CATEGORIES):
+            self.assertEqual(copy.lookup(code), index.lookup(code))
+        with self.assertRaises(TypeError):
+            copy.groups["MACE"] = 0
+
+if __name__ == "__main__":
+    unittest.main()
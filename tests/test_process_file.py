@@ -0,0 +1,127 @@
+#Developed by ODAT project
+#please see https://odat.info
+#please see https://github.com/ODAT-Project
+"""
+regression tests: process_file must write the same bytes as the original
+row-by-row loop of ICD9App, however the input is read or split up.
+"""
+import importlib.util
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "benchmarks"))
+
+import generate_dx
+
+builder = generate_dx.load_builder()
+
+def _has(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+#hand-written rows for what the generator doesn't cover, missing-value
+#markers included
+EDGE_ROWS = """Reference Key,Sex,All Diagnosis Code (ICD9),Reference Date
+1,M,"430e0",2020-09-17
+2,F,"",2020-01-01
+3,M,"410.01;;428 , V45.81",2019-05-05
+4,F,"  401.9  ",2018-02-03
+5,M,"436-438",2017-04-04
+6,F,"E800.1/E807",2016-06-06
+7,M,"abc 410.",2015-07-07
+8,F,"433.10|434.91",2014-08-08
+None,M,"410.01",NA
+n/a,F,"None",null
+9,M,"NULL",#N/A
+"""
+
+def old_loop(file_path: str, save_path: str):
+    """the per-row loop of the original ICD9App.select_and_process_file."""
+    import pandas as pd
+
+    categories = builder.ALL_CATEGORIES
+    #keys and dates as text, so a missing key doesn't turn the others into floats
+    df = pd.read_csv(file_path, dtype={"Reference Key": str, "Reference Date": str})
+    new_cols = pd.DataFrame(0, index=df.index, columns=list(categories.keys()) + ["MACE"])
+    df = pd.concat([df, new_cols], axis=1)
+    for i in range(len(df)):
+        row_codes = str(df.at[i, "All Diagnosis Code (ICD9)"])
+        split_codes = [c for c in re.split(r"[^\w\.]", row_codes) if c]
+        any_mace = False
+        for cat, code_list in categories.items():
+            if any(builder.icd9_matches(code, code_list) for code in split_codes):
+                df.at[i, cat] = 1
+                if cat in builder.MACE_CATEGORY_NAMES:
+                    any_mace = True
+        df.at[i, "MACE"] = 1 if any_mace else 0
+    output_cols = ["Reference Key", "MACE", "Reference Date"] + list(categories.keys())
+    df[output_cols].to_csv(save_path, index=False)
+
+class ProcessFileMatchesOldLoopTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.generated = os.path.join(cls.tmp.name, "generated.csv")
+        generate_dx.generate(cls.generated, 3000, seed=7, builder=builder)
+        cls.edge = os.path.join(cls.tmp.name, "edge.csv")
+        with open(cls.edge, "w", newline="") as f:
+            f.write(EDGE_ROWS)
+        cls.expected = {}
+        for path in (cls.generated, cls.edge):
+            expected = path + ".expected.csv"
+            old_loop(path, expected)
+            with open(expected, "rb") as f:
+                cls.expected[path] = f.read()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def assert_matches_old_loop(self, **kwargs):
+        for path in (self.generated, self.edge):
+            with self.subTest(input=os.path.basename(path), **kwargs):
+                save_path = os.path.join(self.tmp.name, "out.csv")
+                builder.process_file(path, save_path, **kwargs)
+                with open(save_path, "rb") as f:
+                    self.assertEqual(f.read(), self.expected[path])
+
+    def test_whole_file(self):
+        self.assert_matches_old_loop()
+
+    def test_chunked(self):
+        self.assert_matches_old_loop(chunksize=7)
+        self.assert_matches_old_loop(chunksize=500)
+
+    def test_workers(self):
+        self.assert_matches_old_loop(chunksize=1000, workers=2)
+
+    @unittest.skipUnless(_has("pyarrow"), "needs pyarrow")
+    def test_pyarrow_engine(self):
+        self.assert_matches_old_loop(engine="pyarrow")
+        self.assert_matches_old_loop(chunksize=500, engine="pyarrow")
+
+class GroupColumnsTest(unittest.TestCase):
+    def test_one_flag_column_per_group(self):
+        import pandas as pd
+
+        categories = dict(builder.ALL_CATEGORIES)
+        names = list(categories)
+        groups = {"First two": names[:2], "MACE": builder.MACE_CATEGORY_NAMES}
+        cache = builder.CodeMaskCache(builder.CategoryIndex(categories, groups))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "edge.csv")
+            with open(path, "w", newline="") as f:
+                f.write(EDGE_ROWS)
+            save_path = os.path.join(tmp, "out.csv")
+            builder.process_file(path, save_path, cache=cache)
+            out = pd.read_csv(save_path)
+        self.assertEqual(list(out.columns), ["Reference Key", "First two", "MACE", "Reference Date"] + names)
+        for name, members in groups.items():
+            with self.subTest(group=name):
+                self.assertEqual(out[name].tolist(), out[members].max(axis=1).tolist())
+
+if __name__ == "__main__":
+    unittest.main()
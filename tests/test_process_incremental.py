@@ -0,0 +1,155 @@
+#Developed by ODAT project
+#please see https://odat.info
+#please see https://github.com/ODAT-Project
+"""
+watermark tests: after every append, process_incremental must leave the
+same bytes as a full process_file run over the whole input.
+"""
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, os.pardir, "benchmarks"))
+
+import generate_dx
+
+builder = generate_dx.load_builder()
+
+def _has(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+class ProcessIncrementalMatchesFullRunTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        generated = os.path.join(cls.tmp.name, "generated.csv")
+        generate_dx.generate(generated, 2000, seed=11, builder=builder)
+        with open(generated, "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        cls.header, cls.rows = lines[0], lines[1:]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        self.new_paths()
+
+    def new_paths(self):
+        self.dir = tempfile.mkdtemp(dir=self.tmp.name)
+        self.input = os.path.join(self.dir, "dx.csv")
+        self.output = os.path.join(self.dir, "dx_dx.csv")
+
+    def write_input(self, data: bytes, mode: str = "wb"):
+        with open(self.input, mode) as f:
+            f.write(data)
+
+    def assert_matches_full_run(self, **kwargs):
+        #a fresh full run over the current input is the reference
+        expected = os.path.join(self.dir, "expected.csv")
+        builder.process_file(self.input, expected, kwargs.get("chunksize"), cache=kwargs.get("cache"),
+                             packed=kwargs.get("packed", False))
+        with open(expected, "rb") as f, open(self.output, "rb") as g:
+            self.assertEqual(g.read(), f.read())
+
+    def run_incremental(self, **kwargs) -> tuple:
+        return builder.process_incremental(self.input, self.output, **kwargs)
+
+    def test_appends_match_full_run(self):
+        settings = [
+            {},
+            {"chunksize": 7},
+            {"chunksize": 300, "workers": 2},
+            {"packed": True},
+        ]
+        if _has("pyarrow"):
+            settings.append({"chunksize": 250, "engine": "pyarrow"})
+        for kwargs in settings:
+            with self.subTest(**kwargs):
+                self.new_paths()
+                self.write_input(self.header + b"".join(self.rows[:500]))
+                self.assertEqual(self.run_incremental(**kwargs), (500, True))
+                self.assert_matches_full_run(**kwargs)
+                for start, end in ((500, 501), (501, 1200), (1200, 2000)):
+                    self.write_input(b"".join(self.rows[start:end]), "ab")
+                    self.assertEqual(self.run_incremental(**kwargs), (end - start, False))
+                    self.assert_matches_full_run(**kwargs)
+
+    def test_nothing_or_blank_lines_appended(self):
+        self.write_input(self.header + b"".join(self.rows[:100]))
+        self.run_incremental()
+        self.assertEqual(self.run_incremental(), (0, False))
+        self.assert_matches_full_run()
+        self.write_input(b"\n\r\n\n", "ab")
+        self.assertEqual(self.run_incremental(), (0, False))
+        self.assert_matches_full_run()
+        self.write_input(b"".join(self.rows[100:150]), "ab")
+        self.assertEqual(self.run_incremental(), (50, False))
+        self.assert_matches_full_run()
+
+    def test_input_without_final_newline(self):
+        last = self.rows[99].rstrip(b"\r\n")
+        self.write_input(self.header + b"".join(self.rows[:99]) + last)
+        self.run_incremental()
+        #rows that start on a new line are appended
+        self.write_input(b"\n" + b"".join(self.rows[100:120]).rstrip(b"\n"), "ab")
+        self.assertEqual(self.run_incremental(), (20, False))
+        self.assert_matches_full_run()
+        #bytes that continue the last processed line force a rebuild
+        self.write_input(b"9", "ab")
+        self.assertEqual(self.run_incremental(), (120, True))
+        self.assert_matches_full_run()
+
+    def test_changed_prefix_rebuilds(self):
+        self.write_input(self.header + b"".join(self.rows[:300]))
+        self.run_incremental()
+        self.write_input(self.header + b"".join(self.rows[1:300]) + b"".join(self.rows[300:400]))
+        self.assertEqual(self.run_incremental(), (399, True))
+        self.assert_matches_full_run()
+
+    def test_changed_definitions_rebuild(self):
+        self.write_input(self.header + b"".join(self.rows[:300]))
+        self.run_incremental()
+        names = list(builder.ALL_CATEGORIES)
+        cache = builder.CodeMaskCache(builder.CategoryIndex(builder.ALL_CATEGORIES, {"MACE": names[:2]}))
+        self.assertEqual(self.run_incremental(cache=cache), (300, True))
+        self.assert_matches_full_run(cache=cache)
+        self.assertEqual(self.run_incremental(packed=True), (300, True))
+        self.assert_matches_full_run(packed=True)
+
+    def test_interrupted_append_is_dropped(self):
+        self.write_input(self.header + b"".join(self.rows[:300]))
+        self.run_incremental()
+        #output written past the recorded size by a run that never saved its state
+        with open(self.output, "ab") as f:
+            f.write(b"half a ro")
+        self.write_input(b"".join(self.rows[300:310]), "ab")
+        self.assertEqual(self.run_incremental(), (10, False))
+        self.assert_matches_full_run()
+
+    def test_unusable_state_rebuilds(self):
+        state_path = self.output + ".state.json"
+        self.write_input(self.header + b"".join(self.rows[:200]))
+        self.run_incremental()
+        with open(state_path) as f:
+            state = json.load(f)
+        broken = [
+            "not json",
+            json.dumps([]),
+            json.dumps({k: v for k, v in state.items() if k != "rows"}),
+            json.dumps({**state, "input_bytes": str(state["input_bytes"])}),
+            json.dumps({**state, "version": state["version"] + 1}),
+        ]
+        for text in broken:
+            with self.subTest(state=text[:40]):
+                with open(state_path, "w") as f:
+                    f.write(text)
+                self.assertEqual(self.run_incremental(), (200, True))
+                self.assert_matches_full_run()
+
+if __name__ == "__main__":
+    unittest.main()